@@ -2,6 +2,7 @@
 # Utilities for talking to esmond
 
 
+import calendar
 import pscheduler
 
 log = pscheduler.Log(prefix="archiver-esmond", quiet=True)
@@ -9,6 +10,9 @@ log = pscheduler.Log(prefix="archiver-esmond", quiet=True)
 #Number of seconds to wait if no bytes received on wire
 HTTP_TIMEOUT=5
 
+#Returned by create_data() when the data is a duplicate and that isn't ok
+DATA_CONFLICT = "409: Duplicate data"
+
 DEFAULT_SUMMARIES = {
     "throughput": [
         {
@@ -166,7 +170,7 @@ def iso8601_to_seconds(val):
     td = pscheduler.iso8601_as_timedelta(val)
     return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10.0**6) / 10.0**6
 
-def handle_storage_error(result, attempts=0, policy=[]):
+def storage_error_result(result, attempts=0, policy=[]):
     #build object
     retry = False
     archive_err_result = { 'succeeded': False, 'error': result }
@@ -180,8 +184,89 @@ def handle_storage_error(result, attempts=0, policy=[]):
     
     if not retry:
         archive_err_result['error'] = "Archiver permanently abandoned registering test after %d attempt(s): %s" % (attempts+1, result)
-    
-    pscheduler.succeed_json(archive_err_result)
+
+    return archive_err_result
+
+def handle_storage_error(result, attempts=0, policy=[]):
+    pscheduler.succeed_json(storage_error_result(result, attempts=attempts, policy=policy))
+
+def build_record(json, fast_mode=False):
+    """
+    Build the record for an archiver input.  Returns a tuple of the
+    record and None, or None and an error message if the result can't
+    be stored.
+    """
+    data = json['data']
+    test_type = json['result']['test']['type']
+    test_spec = json['result']['test']['spec']
+    test_result = {}
+    if json['result']['result'] is not None:
+        test_result = json['result']['result']
+
+    #get explicit measurement-agent if set
+    measurement_agent = None
+    if "measurement-agent" in data:
+        measurement_agent = data['measurement-agent']
+
+    #get fields related to data formatting
+    format_mapping = True
+    add_raw_event_type = False
+    fallback_raw = True
+    if "data-formatting-policy" in data:
+        if data['data-formatting-policy'] == 'prefer-mapped':
+            pass # this is the default
+        elif data['data-formatting-policy'] == 'mapped-and-raw':
+            add_raw_event_type = True
+        elif data['data-formatting-policy'] == 'mapped-only':
+            fallback_raw = False
+        elif data['data-formatting-policy'] == 'raw-only':
+            format_mapping = False
+
+    #setup default data summaries
+    summary_map = None
+    if "summaries" in data and data['summaries']:
+        summary_map = {}
+        for summary in data['summaries']:
+            if "event-type" not in summary:
+                continue
+            if summary["event-type"] not in summary_map:
+                summary_map[summary["event-type"]] = []
+            summary_map[summary["event-type"]].append(summary)
+
+    common = {
+        'test_spec': test_spec,
+        'lead_participant': json['result']['participants'][0],
+        'measurement_agent': measurement_agent,
+        'tool_name': 'pscheduler/%s' % json['result']['tool']['name'],
+        'summaries': summary_map,
+        'duration': iso8601_to_seconds(json['result']['schedule']['duration']),
+        'ts': calendar.timegm(pscheduler.iso8601_as_datetime(json['result']['schedule']['start']).utctimetuple()),
+        'test_result': test_result,
+        'fast_mode': fast_mode
+    }
+
+    #determine test type and format metadata and data
+    record_classes = {
+        'latency': EsmondLatencyRecord,
+        'latencybg': EsmondLatencyBGRecord,
+        'throughput': EsmondThroughputRecord,
+        'trace': EsmondTraceRecord,
+        'rtt': EsmondRTTRecord
+    }
+    if format_mapping and test_type in record_classes:
+        record = record_classes[test_type](**common)
+    elif format_mapping and not fallback_raw:
+        return None, "Unable to store result because 'mapped-only' policy is being used and the test is of an unrecognized type %s" % (test_type)
+    else:
+        record = EsmondRawRecord(test_type=test_type, src_field=None, dst_field=None, **common)
+        #we already added raw type, so don't add it again
+        add_raw_event_type = False
+
+    #add raw test result if it was requested we do so
+    if add_raw_event_type:
+        record.enable_data_raw(test_result=test_result)
+
+    return record, None
 
 
 ###
@@ -231,7 +316,7 @@ class EsmondClient:
         return True, result
 
 
-    def create_data(self, metadata_key, data_points):
+    def create_data(self, metadata_key, data_points, conflict_ok=True):
         result = {}
         put_url = self.url
         if not put_url.endswith('/'):
@@ -252,6 +337,8 @@ class EsmondClient:
 
         if status_code == 409:
             #duplicate data
+            if not conflict_ok:
+                return False, DATA_CONFLICT
             log.debug("Attempted to add duplicate data point. Skipping")
         elif status_code not in [200, 201]:
             try:
@@ -766,3 +853,4 @@ class EsmondRawRecord(EsmondBaseRecord):
     
     def add_additional_data(self, data_point={}, test_spec={}, test_result={}):
         self.add_data(data_point=data_point, event_type='pscheduler-raw', val=test_result)
+
@@ -60,6 +60,7 @@ Requires:	pscheduler-server
 Requires:	mod_ssl
 Requires:	mod_wsgi
 Requires:	python-pscheduler >= 1.1
+Requires:	python-repoze.lru
 Requires:	python-requests
 Requires:	pytz
 
@@ -109,6 +110,10 @@ The pScheduler server
 # there'd have to be a 'chcon -R -t httpd_user_content_t'.
 %define api_dir	     %{_var}/www/%{name}
 
+# Most database connections each API server process will hold.  Zero
+# computes a limit from the database's max_connections.
+%define api_db_pool_max 0
+
 
 # ------------------------------------------------------------------------------
 
@@ -149,6 +154,7 @@ make -C daemons \
      PGUSER=%{_pscheduler_database_user} \
      PSUSER=%{_pscheduler_user} \
      ARCHIVERDEFAULTDIR=%{archiver_default_dir} \
+     CLASSESDIR=%{_pscheduler_classes} \
      VAR=%{_var}
 
 #
@@ -239,6 +245,7 @@ make -C api-server \
      "PREFIX=${RPM_BUILD_ROOT}" \
      "DSN_FILE=%{dsn_file}" \
      "LIMITS_FILE=%{_pscheduler_limit_config}" \
+     "DB_POOL_MAX=%{api_db_pool_max}" \
      install
 
 mkdir -p ${RPM_BUILD_ROOT}/%{server_conf_dir}
@@ -261,7 +268,7 @@ mkdir -p ${RPM_BUILD_ROOT}/%{server_conf_dir}
 #
 if [ "$1" -eq 2 ]
 then
-    for SERVICE in ticker runner archiver scheduler
+    for SERVICE in pluginhost ticker rundata runner archiver scheduler
     do
         NAME="pscheduler-${SERVICE}"
 %if 0%{?el6}
@@ -469,7 +476,7 @@ EOF
 #
 # Daemons
 #
-for SERVICE in ticker runner archiver scheduler
+for SERVICE in pluginhost ticker rundata runner archiver scheduler
 do
     NAME="pscheduler-${SERVICE}"
 %if 0%{?el6}
@@ -523,7 +530,7 @@ systemctl restart httpd
 #
 # Daemons
 #
-for SERVICE in ticker runner archiver scheduler
+for SERVICE in pluginhost ticker rundata runner archiver scheduler
 do
     NAME="pscheduler-${SERVICE}"
 %if 0%{?el6}
@@ -608,7 +615,7 @@ if [ "$1" = "0" ]; then
     # fi
 else
     #we're doing an update so restart services
-    for SERVICE in ticker runner archiver scheduler
+    for SERVICE in pluginhost ticker rundata runner archiver scheduler
     do
         NAME="pscheduler-${SERVICE}"
 %if 0%{?el6}
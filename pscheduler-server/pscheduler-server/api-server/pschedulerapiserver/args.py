@@ -72,6 +72,21 @@ def arg_json(name, max_schema=None):
     return json
 
 
+def arg_fields(name, allowed=None):
+    """Fetch and validate a comma-separated list of field names,
+    returning them as a set or None if not specified.  If allowed is
+    None, any name is accepted."""
+    argval = request.args.get(name)
+    if argval is None:
+        return None
+    fields = set([ field.strip() for field in argval.split(",")
+                   if field.strip() ])
+    unknown = set() if allowed is None else fields - set(allowed)
+    if unknown:
+        raise ValueError("Unknown field(s) %s" % (", ".join(sorted(unknown))))
+    return fields
+
+
 def arg_uuid(name):
     """Fetch and validate an argument as a UUID"""
     argval = request.args.get(name)
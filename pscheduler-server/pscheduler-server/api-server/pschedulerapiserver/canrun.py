@@ -0,0 +1,163 @@
+#
+# Tool Can-Run Checks
+#
+# Finding out which tools can run a test means asking each candidate
+# tool by invoking its can-run method.  These are run in parallel so
+# the time taken doesn't grow with the number of tools installed, and
+# the answers are kept for a short while since leads tend to ask the
+# same question of every participant over and over.
+#
+
+import pscheduler
+import sys
+import threading
+
+from repoze.lru import ExpiringLRUCache
+
+from .dbcursor import dbcursor_query
+from .log import log
+
+module = sys.modules[__name__]
+
+# Number of answers to hold
+module.size = 1000
+
+# Seconds to hold each answer
+module.ttl = 30
+
+# Most can-run methods to run at once
+module.threads = 10
+
+# Seconds to give each can-run method
+module.timeout = 5
+
+module.cache = None
+
+# Statistics
+module.stats_lock = threading.Lock()
+module.hits = 0
+module.misses = 0
+module.failures = 0
+
+
+def canrun_init(size=None, ttl=None):
+    """
+    Initialize the module.  Yes, this is global state.
+    """
+    if size is not None:
+        module.size = size
+    if ttl is not None:
+        module.ttl = ttl
+    module.cache = ExpiringLRUCache(module.size, default_timeout=module.ttl)
+
+
+
+def __can_run(tool, version, test, test_text, lead_bind):
+    """
+    INTERNAL USE ONLY: Determine whether or not a tool can run a test,
+    asking it only if the answer isn't cached.
+    """
+
+    key = (tool, version, test_text, lead_bind)
+
+    answer = module.cache.get(key)
+    if answer is not None:
+        with module.stats_lock:
+            module.hits += 1
+        return answer
+
+    with module.stats_lock:
+        module.misses += 1
+
+    # HACK: BWCTLBC
+    env_add = {}
+    if lead_bind is not None:
+        env_add["PSCHEDULER_LEAD_BIND_HACK"] = lead_bind
+
+    try:
+        status, stdout, stderr = pscheduler.run_program(
+            [ "pscheduler", "internal", "invoke", "tool", tool, "can-run" ],
+            stdin=pscheduler.json_dump(test),
+            timeout=module.timeout,
+            env_add=env_add
+        )
+    except Exception as ex:
+        status, stdout, stderr = 1, "", str(ex)
+
+    # Any result other than success indicates a problem that shouldn't
+    # be allowed to gum up the works.  Log it, assume the tool said no
+    # dice and don't hold on to the answer.
+
+    if status != 0:
+        log.warning("Tool \"%s\" failed can-run: %s", tool, stderr)
+        with module.stats_lock:
+            module.failures += 1
+        return False
+
+    try:
+        answer = pscheduler.json_load(stdout)["can-run"] is True
+    except (ValueError, KeyError, TypeError):
+        log.warning("Tool \"%s\" returned invalid JSON \"%s\"", tool, stdout)
+        with module.stats_lock:
+            module.failures += 1
+        return False
+
+    module.cache.put(key, answer)
+    return answer
+
+
+
+def canrun_tools_for_test(test, lead_bind=None):
+    """
+    Return a list of the enumerations of all tools that can run a
+    test, in order of highest to lowest preference.
+    """
+
+    if not isinstance(test, dict) or "type" not in test:
+        raise ValueError("No test type found in JSON")
+
+    cursor = dbcursor_query("""
+        SELECT
+            tool.name,
+            tool.json ->> 'version',
+            tool.json
+        FROM
+            test
+            JOIN tool_test ON tool_test.test = test.id
+            JOIN tool ON tool.id = tool_test.tool
+        WHERE
+            test.name = %s
+            AND test.available
+            AND tool.available
+        ORDER BY
+            tool.preference DESC,
+            tool.name ASC
+        """, [test["type"]])
+    candidates = cursor.fetchall()
+    cursor.close()
+
+    # Pretty output has its keys sorted, which makes it repeatable.
+    test_text = pscheduler.json_dump(test, pretty=True)
+
+    answers = pscheduler.fan_out(
+        lambda (tool, version, enumeration): __can_run(
+            tool, version, test, test_text, lead_bind),
+        candidates, threads=module.threads)
+
+    return [ enumeration
+             for ((tool, version, enumeration), answer)
+             in zip(candidates, answers)
+             if answer ]
+
+
+
+def canrun_stats():
+    """Return statistics about the cache"""
+    with module.stats_lock:
+        return {
+            "size": module.size,
+            "ttl": module.ttl,
+            "hits": module.hits,
+            "misses": module.misses,
+            "failures": module.failures
+        }
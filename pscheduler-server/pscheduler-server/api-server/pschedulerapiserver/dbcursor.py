@@ -2,11 +2,16 @@
 # Database Cursor
 #
 
+import collections
 import pscheduler
 import psycopg2
+import psycopg2.pool
 import sys
 import threading
 import time
+import uuid
+
+from pschedulerapiserver import application
 
 from .log import log
 
@@ -19,10 +24,229 @@ module.threadlocal = threading.local()
 
 module.dsn = None   # DSN for DB connection
 
+# Connection pool tuning
+
+module.pool = None           # Shared pool of connections
+module.pool_max = None       # Most connections to hold; None to compute
+module.pool_fraction = 0.25  # Fraction of max_connections when computing
+module.pool_wait = 10        # Seconds to wait for a free connection
+module.pool_idle_check = 30  # Seconds idle before a health check on reuse
+
 
-def dbcursor_init(dsn):
+def dbcursor_init(dsn, pool_max=None):
     """Initialize the module.  Yes, this is global state."""
     module.dsn = dsn
+    module.pool_max = pool_max
+    module.pool = None
+
+
+
+class DBPool:
+
+    """
+    Bounded, thread-safe pool of database connections shared by all
+    of the threads in this process.  Connections are handed out
+    whole, checked for health when they've been idle for a while and
+    replaced if they've gone bad.
+    """
+
+    def __init__(self, dsn, max_size=None):
+
+        self.dsn = dsn
+        self.max_size = max_size
+
+        self.lock = threading.Condition()
+        self.idle = []      # Tuples of (connection, time last returned)
+        self.in_use = 0
+
+        # Statistics
+        self.started = time.time()
+        self.connects = 0
+        self.connect_times = collections.deque(maxlen=1000)
+        self.failures = 0
+        self.waits = 0
+        self.discards = 0
+
+
+    def __connect(self):
+        """
+        INTERNAL USE ONLY: Make a new connection, trying a few times
+        before giving up.
+        """
+
+        tries = module.tries
+        reason = None
+
+        while tries:
+            try:
+                db = pscheduler.pg_connection(self.dsn, name="api")
+                break
+            except psycopg2.OperationalError as ex:
+                reason = ex
+                tries -= 1
+                with self.lock:
+                    self.failures += 1
+                log.debug("Attempt failed, %d left", tries)
+                time.sleep(module.interval)
+
+        if not tries:
+            log.warning("Failed to connect to the database.")
+            raise reason
+
+        with self.lock:
+            self.connects += 1
+            self.connect_times.append(time.time())
+
+        # If no size was specified, take a fraction of what the server
+        # allows for everyone.
+
+        if self.max_size is None:
+            self.max_size = self.__size_from_server(db)
+            log.debug("Pool size is %d", self.max_size)
+
+        return db
+
+
+    def __size_from_server(self, db):
+        """
+        INTERNAL USE ONLY: Figure out a pool size from the server's
+        maximum connections.
+        """
+        try:
+            cursor = db.cursor()
+            cursor.execute("SHOW max_connections")
+            max_connections = int(cursor.fetchone()[0])
+            cursor.close()
+        except Exception as ex:
+            log.warning("Failed to fetch maximum connections: %s", str(ex))
+            # This is the PgSQL default
+            max_connections = 100
+        return max(1, int(max_connections * module.pool_fraction))
+
+
+    def __healthy(self, db, idle_since):
+        """
+        INTERNAL USE ONLY: Determine whether a connection coming out of
+        the idle list is usable.
+        """
+        if db.closed:
+            return False
+        if time.time() - idle_since < module.pool_idle_check:
+            return True
+        try:
+            cursor = db.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+    def __discard(self, db):
+        """
+        INTERNAL USE ONLY: Throw away a connection.
+        """
+        try:
+            db.close()
+        except Exception:
+            pass  # Best effort.
+
+
+    def get(self):
+        """
+        Get a connection from the pool, waiting for one to become
+        available if the pool is full.
+        """
+
+        deadline = time.time() + module.pool_wait
+        waited = False
+
+        with self.lock:
+            while True:
+                if self.idle:
+                    db, idle_since = self.idle.pop()
+                    self.in_use += 1
+                    break
+                if self.max_size is None \
+                   or (self.in_use + len(self.idle)) < self.max_size:
+                    db, idle_since = None, None
+                    self.in_use += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(
+                        "Database connection pool exhausted")
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self.lock.wait(remaining)
+
+        # Do any talking to the server outside the lock.
+
+        try:
+            if db is not None and not self.__healthy(db, idle_since):
+                log.debug("Replacing unhealthy connection")
+                self.__discard(db)
+                with self.lock:
+                    self.discards += 1
+                db = None
+            if db is None:
+                db = self.__connect()
+        except Exception:
+            with self.lock:
+                self.in_use -= 1
+                self.lock.notify()
+            raise
+
+        return db
+
+
+    def put(self, db):
+        """
+        Return a connection to the pool.  Connections that have been
+        closed are dropped.
+        """
+        broken = db.closed
+        if broken:
+            self.__discard(db)
+        with self.lock:
+            self.in_use -= 1
+            if broken:
+                self.discards += 1
+            else:
+                self.idle.append((db, time.time()))
+            self.lock.notify()
+
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the pool.
+        """
+        now = time.time()
+        with self.lock:
+            recent = len([ when for when in self.connect_times
+                           if now - when <= 60 ])
+            return {
+                "max": self.max_size,
+                "in-use": self.in_use,
+                "idle": len(self.idle),
+                "waits": self.waits,
+                "connects": self.connects,
+                "connects-per-second": recent / 60.0,
+                "connect-failures": self.failures,
+                "discards": self.discards,
+                "uptime": pscheduler.timedelta_as_iso8601(
+                    pscheduler.seconds_as_timedelta(now - self.started))
+            }
+
+
+
+def dbpool():
+    """Get the process-wide connection pool, creating it if necessary."""
+    if module.pool is None:
+        assert (module.dsn is not None)
+        module.pool = DBPool(module.dsn, module.pool_max)
+    return module.pool
 
 
 
@@ -40,41 +264,55 @@ class DBCursor:
 
         if self.db is None or self.db.closed:
 
-            # Reset everything.
+            # Give back anything that's gone bad and reset everything.
 
-            self.db = None
-            self.ccursor = None
+            self.release()
+            self.db = dbpool().get()
 
-            assert (module.dsn is not None)
+        # Make sure we have a cursor.
 
-            tries = module.tries
+        if self.ccursor is None or self.ccursor.closed:
+            self.ccursor = self.db.cursor()
 
-            while tries:
-                try:
-                    self.db = pscheduler.pg_connection(module.dsn, name="api")
-                    break
-                except psycopg2.OperationalError as ex:
-                    reason = ex
-                    tries -= 1
-                    log.debug("Attempt failed, %d left", tries)
-                    time.sleep(module.interval)
+        return self.ccursor
 
-            if self.db is None:
-                log.warning("Failed to connect to the database.")
-                raise reason;
 
-        # Make sure we have a cursor.
+    def release(self):
+        """Return the connection to the pool."""
 
-        if self.ccursor is None or self.ccursor.closed():
-            self.ccursor = self.db.cursor()
+        if self.ccursor is not None and not self.ccursor.closed:
+            try:
+                self.ccursor.close()
+            except psycopg2.Error:
+                pass
+        self.ccursor = None
 
-        return self.ccursor
+        if self.db is not None:
+            dbpool().put(self.db)
+            self.db = None
 
 
 
 def dbcursor():
     """Get this thread's database cursor"""
-    return getattr(threadlocal, "cursor", DBCursor()).cursor()
+    try:
+        holder = threadlocal.cursor
+    except AttributeError:
+        holder = threadlocal.cursor = DBCursor()
+    return holder.cursor()
+
+
+@application.teardown_request
+def dbcursor_release(exception=None):
+    """Hand this thread's connection back to the pool after each request"""
+    holder = getattr(threadlocal, "cursor", None)
+    if holder is not None:
+        holder.release()
+
+
+def dbcursor_pool_stats():
+    """Return statistics about the connection pool"""
+    return dbpool().stats()
 
 
 def dbcursor_query(query,
@@ -123,3 +361,69 @@ def dbcursor_query(query,
     log.debug("QUERY returned %s rows", rows)
 
     return cursor
+
+
+
+class DBStream:
+
+    """
+    Rows from a query run with a server-side cursor, fetched in
+    batches as they're iterated over.  The stream has a database
+    connection of its own that goes back to the pool when the rows run
+    out or close() is called, which makes it usable after the request
+    that started it has been torn down (e.g., in a streamed response).
+    """
+
+    def __init__(self, query, args, batch):
+
+        self.pool = dbpool()
+        self.db = self.pool.get()
+
+        try:
+            # Server-side cursors only live inside a transaction.
+            self.db.autocommit = False
+            self.cursor = self.db.cursor(name="stream_%s" % (uuid.uuid4().hex))
+            self.cursor.itersize = batch
+            self.cursor.execute(query, args)
+        except Exception:
+            self.close()
+            raise
+
+
+    def __iter__(self):
+        try:
+            for row in self.cursor:
+                yield row
+        finally:
+            self.close()
+
+
+    def close(self):
+        """Give back the connection.  This can be called repeatedly."""
+
+        if self.db is None:
+            return
+
+        db = self.db
+        self.db = None
+
+        try:
+            db.rollback()
+            db.autocommit = True
+        except psycopg2.Error:
+            db.close()
+
+        self.pool.put(db)
+
+
+
+def dbcursor_stream(query,
+                    args=[],
+                    batch=500   # Rows to fetch at a time
+                    ):
+    """
+    Run a query and return a DBStream of its rows.  The query is run
+    before this returns so problems with it can be handled normally.
+    """
+    log.debug("STREAM QUERY: %s, %s", query, args)
+    return DBStream(query, args, batch)
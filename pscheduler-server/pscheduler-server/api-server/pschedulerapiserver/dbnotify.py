@@ -0,0 +1,244 @@
+#
+# Database Notification Dispatcher
+#
+
+import errno
+import pscheduler
+import select
+import sys
+import threading
+import time
+
+from .log import log
+
+module = sys.modules[__name__]
+
+module.dsn = None   # DSN for DB connection
+
+module.notifier = None
+module.notifier_lock = threading.Lock()
+
+# Channels listened to.  Notifications on these should carry the UUID
+# of the run as their payload.
+module.channels = [ "run_new", "run_change", "result_available" ]
+
+# Longest a waiter goes without re-checking, which covers for missed
+# notifications if the connection to the database goes away.
+module.max_wait = 5
+
+# How long to wait between attempts to reconnect to the database
+module.reconnect_interval = 2
+
+# Functions called with the payload of each notification, keyed by
+# channel.
+module.hooks = {}
+module.hooks_lock = threading.Lock()
+
+
+def dbnotify_init(dsn):
+    """Initialize the module.  Yes, this is global state."""
+    module.dsn = dsn
+
+
+def dbnotify_hook(channel, function):
+    """
+    Call a function with the payload of every notification that
+    arrives on a channel.  Hooks are called by the listener and should
+    return quickly.
+    """
+    assert channel in module.channels
+    with module.hooks_lock:
+        module.hooks.setdefault(channel, []).append(function)
+
+
+
+class DBNotifier(object):
+
+    """
+    Listens for notifications from the database in a thread of its
+    own and wakes up anything waiting for them.  Waiters register an
+    interest in a channel and payload, or in a channel with any
+    payload by using None.
+    """
+
+    def __init__(self, dsn):
+
+        self.dsn = dsn
+        self.lock = threading.Lock()
+        self.waiters = {}  # Sets of Events keyed by (channel, payload)
+
+        # Statistics
+        self.received = 0
+        self.wakeups = 0
+        self.connects = 0
+
+        self.thread = threading.Thread(target=self.__run,
+                                       name="dbnotify")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def __run(self):
+        """INTERNAL USE ONLY: Listen and dispatch forever."""
+        while True:
+            try:
+                self.__listen()
+            except Exception as ex:
+                log.warning("Notification listener failed: %s", str(ex))
+            # Anything waiting may have missed something.
+            self.__wake_all()
+            time.sleep(module.reconnect_interval)
+
+
+    def __listen(self):
+        """INTERNAL USE ONLY: Connect, listen and dispatch."""
+
+        db = pscheduler.pg_connection(self.dsn, name="api-notify")
+        self.connects += 1
+
+        try:
+            with db.cursor() as cursor:
+                for channel in module.channels:
+                    cursor.execute("LISTEN %s" % (channel))
+            log.debug("Listening for notifications")
+
+            while True:
+                try:
+                    if select.select([db], [], [], 60) == ([], [], []):
+                        continue
+                except select.error as ex:
+                    err_no, message = ex
+                    if err_no == errno.EINTR:
+                        continue
+                    raise
+
+                db.poll()
+                notifies = db.notifies[:]
+                del db.notifies[:]
+
+                for notify in notifies:
+                    self.received += 1
+                    self.__wake(notify.channel, notify.payload)
+
+        finally:
+            db.close()
+
+
+    def __wake(self, channel, payload):
+        """INTERNAL USE ONLY: Wake anything waiting on a notification"""
+        with self.lock:
+            events = self.waiters.get((channel, payload), set()) \
+                | self.waiters.get((channel, None), set())
+            for event in events:
+                event.set()
+                self.wakeups += 1
+
+        with module.hooks_lock:
+            hooks = list(module.hooks.get(channel, []))
+        for hook in hooks:
+            try:
+                hook(payload)
+            except Exception as ex:
+                log.warning("Notification hook for %s failed: %s",
+                            channel, str(ex))
+
+
+    def __wake_all(self):
+        """INTERNAL USE ONLY: Wake everything."""
+        with self.lock:
+            for events in self.waiters.values():
+                for event in events:
+                    event.set()
+
+
+    def add(self, keys, event):
+        """Register an event to be set when any of the keys arrive"""
+        with self.lock:
+            for key in keys:
+                self.waiters.setdefault(key, set()).add(event)
+
+
+    def remove(self, keys, event):
+        """Unregister an event"""
+        with self.lock:
+            for key in keys:
+                events = self.waiters.get(key, None)
+                if events is None:
+                    continue
+                events.discard(event)
+                if not events:
+                    del self.waiters[key]
+
+
+    def stats(self):
+        """
+        Return a dictionary of statistics about the notifier.
+        """
+        with self.lock:
+            return {
+                "connects": self.connects,
+                "received": self.received,
+                "wakeups": self.wakeups,
+                "waiting": len(set([ event
+                                     for events in self.waiters.values()
+                                     for event in events ]))
+            }
+
+
+
+def dbnotifier():
+    """Get the process-wide notifier, starting it if necessary."""
+    with module.notifier_lock:
+        if module.notifier is None:
+            assert (module.dsn is not None)
+            module.notifier = DBNotifier(module.dsn)
+    return module.notifier
+
+
+
+class DBNotifyWaiter(object):
+
+    """
+    Waits for notifications from the database.  Use this as a context
+    manager and check for whatever's being waited for inside of it
+    before calling wait() so that nothing arriving in between is
+    missed:
+
+        with DBNotifyWaiter([("run_change", run_uuid)]) as waiter:
+            while not_ready() and waiter.wait(deadline):
+                pass
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.event = threading.Event()
+        self.notifier = dbnotifier()
+
+
+    def __enter__(self):
+        self.notifier.add(self.keys, self.event)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.notifier.remove(self.keys, self.event)
+
+
+    def wait(self, deadline):
+        """
+        Wait until notified or the deadline (a time.time() value)
+        passes.  Returns False if the deadline has passed and True if
+        whatever's being waited for should be checked again.
+        """
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        self.event.wait(min(remaining, module.max_wait))
+        self.event.clear()
+        return True
+
+
+
+def dbnotify_stats():
+    """Return statistics about the notifier"""
+    return dbnotifier().stats()
@@ -37,6 +37,37 @@ def ok_json(data=None):
     return Response(text + '\n',
                     mimetype='application/json')
 
+def not_modified(etag):
+    log.debug("Response 304: %s", etag)
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def ok_json_stream(rows, transform):
+    """
+    Send a JSON array of transform(row) for each row in an iterable
+    as the rows arrive.  If the rows have a close() method, it will be
+    called when the response is finished.  The transform is called
+    after the request is over and can't use anything from it.
+    """
+    pretty = arg_boolean('pretty')
+
+    def generate():
+        separator = "["
+        for row in rows:
+            sanitized = pscheduler.json_decomment(transform(row),
+                                                  prefix="_", null=True)
+            yield separator + "\n" + pscheduler.json_dump(sanitized,
+                                                          pretty=pretty)
+            separator = ","
+        yield ("[" if separator == "[" else "") + "\n]\n"
+
+    log.debug("Response 200+JSON (streamed)")
+    response = Response(generate(), mimetype='application/json')
+    if hasattr(rows, "close"):
+        response.call_on_close(rows.close)
+    return response
+
 def bad_request(message="Bad request"):
     log.debug("Response 400: %s", message)
     return Response(message + '\n', status=400, mimetype="text/plain")
@@ -0,0 +1,218 @@
+#
+# Formatted Result Cache
+#
+
+import hashlib
+import pscheduler
+import Queue
+import sys
+import threading
+
+from repoze.lru import LRUCache
+
+from .dbcursor import dbcursor_query
+from .dbcursor import dbcursor_release
+from .dbnotify import dbnotifier
+from .dbnotify import dbnotify_hook
+from .log import log
+
+module = sys.modules[__name__]
+
+# Number of formatted results to hold
+module.size = 1000
+
+module.cache = None
+
+# Formats that may be produced ahead of time when a run's result
+# becomes available.  Only runs whose results have been asked for in
+# one of these formats are warmed, since formatting everything would
+# cost more than it saves.
+module.warm_formats = [ "text/plain", "text/html" ]
+
+# Sets of formats asked for, keyed by run
+module.requested = None
+
+# Most results waiting to be warmed.  Anything beyond this is dropped.
+module.warm_backlog = 100
+
+module.warm_queue = None
+
+# Statistics
+module.stats_lock = threading.Lock()
+module.hits = 0
+module.misses = 0
+module.warmed = 0
+module.warm_dropped = 0
+
+
+def resultcache_init(size=None):
+    """
+    Initialize the module and start warming results as they become
+    available.  Yes, this is global state.
+    """
+    if size is not None:
+        module.size = size
+    module.cache = LRUCache(module.size)
+    module.requested = LRUCache(module.size)
+
+    if module.warm_formats:
+        module.warm_queue = Queue.Queue(module.warm_backlog)
+        warmer = threading.Thread(target=__warm, name="resultcache-warm")
+        warmer.setDaemon(True)
+        warmer.start()
+        dbnotify_hook("result_available", __warm_request)
+        dbnotifier()
+
+
+
+def result_hash(result):
+    """
+    Produce a hash that changes when a result does.
+    """
+    # Pretty output has its keys sorted, which makes it repeatable.
+    return hashlib.sha1(
+        pscheduler.json_dump(result, pretty=True)).hexdigest()
+
+
+
+def result_etag(run, hashed, format, variant=""):
+    """
+    Produce an entity tag for a run's result in a given format.  The
+    variant covers anything else that changes what's sent.
+    """
+    return hashlib.sha1("%s/%s/%s/%s" % (
+        run, hashed, format, variant)).hexdigest()
+
+
+
+def result_requested(run, format):
+    """
+    Note that a run's result was asked for in a format so it will be
+    warmed if the result changes.
+    """
+    if format not in module.warm_formats:
+        return
+    formats = module.requested.get(run)
+    if formats is None or format not in formats:
+        module.requested.put(run, (formats or frozenset()) | set([format]))
+
+
+
+def result_format(run, test_type, test_spec, result, format, hashed=None):
+    """
+    Format a run's result using the test's result-format method,
+    returning a tuple of success and the formatted result or an error.
+    Successfully-formatted results are cached.
+    """
+
+    if hashed is None:
+        hashed = result_hash(result)
+
+    key = (run, hashed, format)
+
+    formatted = module.cache.get(key)
+    if formatted is not None:
+        with module.stats_lock:
+            module.hits += 1
+        return True, formatted
+
+    with module.stats_lock:
+        module.misses += 1
+
+    returncode, stdout, stderr = pscheduler.run_program(
+        [ "pscheduler", "internal", "invoke", "test", test_type,
+          "result-format", format ],
+        stdin = pscheduler.json_dump({
+            "spec": test_spec,
+            "result": result
+        })
+    )
+
+    if returncode != 0:
+        return False, stderr
+
+    formatted = stdout.rstrip()
+    module.cache.put(key, formatted)
+    return True, formatted
+
+
+
+def __warm_request(run):
+    """
+    INTERNAL USE ONLY: Queue a run to have its result warmed if
+    anyone has asked for it.  This is called by the notification
+    listener and must not block.
+    """
+    if module.requested.get(run) is None:
+        return
+    try:
+        module.warm_queue.put_nowait(run)
+    except Queue.Full:
+        with module.stats_lock:
+            module.warm_dropped += 1
+
+
+
+def __warm():
+    """
+    INTERNAL USE ONLY: Format results as they become available.
+    """
+    while True:
+
+        run = module.warm_queue.get()
+
+        try:
+            cursor = dbcursor_query("""
+                SELECT
+                    test.name,
+                    run.result_merged,
+                    task.json #> '{test, spec}'
+                FROM
+                    run
+                    JOIN task ON task.id = run.task
+                    JOIN test ON test.id = task.test
+                WHERE run.uuid = %s
+                """, [run])
+            row = cursor.fetchone() if cursor.rowcount == 1 else None
+            cursor.close()
+        except Exception as ex:
+            log.warning("Unable to fetch result of %s for warming: %s",
+                        run, str(ex))
+            continue
+        finally:
+            dbcursor_release()
+
+        if row is None:
+            continue
+
+        test_type, result, test_spec = row
+
+        # Failed results don't get formatted.
+        if result is None or not result.get("succeeded", False):
+            continue
+
+        hashed = result_hash(result)
+        for format in module.requested.get(run, frozenset()):
+            succeeded, formatted = result_format(run, test_type, test_spec,
+                                                 result, format, hashed)
+            if not succeeded:
+                log.debug("Unable to warm %s for %s: %s",
+                          format, run, formatted)
+
+        with module.stats_lock:
+            module.warmed += 1
+
+
+
+def resultcache_stats():
+    """Return statistics about the cache"""
+    with module.stats_lock:
+        return {
+            "size": module.size,
+            "hits": module.hits,
+            "misses": module.misses,
+            "warmed": module.warmed,
+            "warm-dropped": module.warm_dropped,
+            "warm-backlog": module.warm_queue.qsize()
+                if module.warm_queue is not None else 0
+        }
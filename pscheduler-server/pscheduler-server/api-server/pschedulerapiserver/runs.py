@@ -12,10 +12,16 @@ from flask import request
 from .access import *
 from .args import arg_integer
 from .dbcursor import dbcursor_query
+from .dbcursor import dbcursor_release
+from .dbnotify import DBNotifyWaiter
 from .json import *
 from .limitproc import *
 from .log import log
 from .response import *
+from .resultcache import result_etag
+from .resultcache import result_format
+from .resultcache import result_hash
+from .resultcache import result_requested
 from .tasks import task_exists
 from .util import *
 
@@ -275,77 +281,83 @@ def tasks_uuid_runs_run(task, run):
 
         if run in ['next', 'first']:
             future = run == 'next'
-            wait_interval = 0.5
-            tries = int(wait_time / wait_interval) if wait_time > 0 \
-                    else 1
-            while tries > 0:
-                try:
-                    run = __runs_first_run(task, future)
-                except Exception as ex:
-                    log.exception()
-                    return error(str(ex))
-                if run is not None:
-                    break
-                if wait_time > 0:
-                    time.sleep(1.0)
-                tries -= 1
+            deadline = time.time() + wait_time
+            with DBNotifyWaiter([("run_new", None)]) as waiter:
+                while True:
+                    try:
+                        run = __runs_first_run(task, future)
+                    except Exception as ex:
+                        log.exception()
+                        return error(str(ex))
+                    if run is not None:
+                        break
+                    # Don't hold a database connection while waiting.
+                    dbcursor_release()
+                    if not waiter.wait(deadline):
+                        break
 
             if run is None:
                 return not_found()
 
 
-        # 60 tries at 0.5s intervals == 30 sec.
-        tries = 60 if (wait_local or wait_merged) else 1
+        # Wait up to 30 seconds for results.  Participant data is
+        # filled in shortly after the run is posted, so always wait
+        # for it if it's on the way.
+        deadline = time.time() + 30
 
-        while tries:
+        with DBNotifyWaiter([("run_change", run.lower()),
+                             ("result_available", run.lower())]) as waiter:
 
-            try:
-                cursor = dbcursor_query(
-                    """
-                    SELECT
-                        lower(run.times),
-                        upper(run.times),
-                        upper(run.times) - lower(run.times),
-                        task.participant,
-                        task.nparticipants,
-                        task.participants,
-                        run.part_data,
-                        run.part_data_full,
-                        run.result,
-                        run.result_full,
-                        run.result_merged,
-                        run_state.enum,
-                        run_state.display,
-                        run.errors,
-                        run.clock_survey,
-                        run.id,
-                        archiving_json(run.id),
-                        run.added
-                    FROM
-                        run
-                        JOIN task ON task.id = run.task
-                        JOIN run_state ON run_state.id = run.state
-                    WHERE
-                        task.uuid = %s
-                        AND run.uuid = %s""", [task, run])
-            except Exception as ex:
-                log.exception()
-                return error(str(ex))
+            while True:
 
-            if cursor.rowcount == 0:
-                cursor.close()
-                return not_found()
+                try:
+                    cursor = dbcursor_query(
+                        """
+                        SELECT
+                            lower(run.times),
+                            upper(run.times),
+                            upper(run.times) - lower(run.times),
+                            task.participant,
+                            task.nparticipants,
+                            task.participants,
+                            run.part_data,
+                            run.part_data_full,
+                            run.result,
+                            run.result_full,
+                            run.result_merged,
+                            run_state.enum,
+                            run_state.display,
+                            run.errors,
+                            run.clock_survey,
+                            run.id,
+                            archiving_json(run.id),
+                            run.added,
+                            run_part_data_pending(run.id)
+                        FROM
+                            run
+                            JOIN task ON task.id = run.task
+                            JOIN run_state ON run_state.id = run.state
+                        WHERE
+                            task.uuid = %s
+                            AND run.uuid = %s""", [task, run])
+                except Exception as ex:
+                    log.exception()
+                    return error(str(ex))
 
-            row = cursor.fetchone()
-            cursor.close()
+                if cursor.rowcount == 0:
+                    cursor.close()
+                    return not_found()
 
-            if not (wait_local or wait_merged):
-                break
-            else:
-                if (wait_local and row[7] is None) \
-                        or (wait_merged and row[9] is None):
-                    time.sleep(0.5)
-                    tries -= 1
+                row = cursor.fetchone()
+                cursor.close()
+
+                if (wait_local and row[8] is None) \
+                        or (wait_merged and row[10] is None) \
+                        or row[18]:
+                    # Don't hold a database connection while waiting.
+                    dbcursor_release()
+                    if not waiter.wait(deadline):
+                        break
                 else:
                     break
 
@@ -621,77 +633,83 @@ def tasks_uuid_runs_run_result(task, run):
 
 
 
+    # Formatted results asked for before they change get formatted
+    # ahead of time.
+    result_requested(run.lower(), format)
+
     #
     # Camp on the run for a result
     #
 
-    # 40 tries at 0.25s intervals == 10 sec.
-    tries = 40 if wait else 1
+    # Wait up to 10 seconds if asked.
+    deadline = time.time() + (10 if wait else 0)
 
-    while tries:
+    with DBNotifyWaiter([("result_available", run.lower())]) as waiter:
 
-        try:
-            cursor = dbcursor_query("""
-                SELECT
-                    test.name,
-                    run.result_merged,
-                    task.json #> '{test, spec}'
-                FROM
-                    run
-                    JOIN task ON task.id = run.task
-                    JOIN test ON test.id = task.test
-                WHERE
-                    task.uuid = %s
-                    AND run.uuid = %s
-                """, [task, run])
-        except Exception as ex:
-            log.exception()
-            return error(str(ex))
+        while True:
 
-        if cursor.rowcount == 0:
-            cursor.close()
-            return not_found()
+            try:
+                cursor = dbcursor_query("""
+                    SELECT
+                        test.name,
+                        run.result_merged,
+                        task.json #> '{test, spec}'
+                    FROM
+                        run
+                        JOIN task ON task.id = run.task
+                        JOIN test ON test.id = task.test
+                    WHERE
+                        task.uuid = %s
+                        AND run.uuid = %s
+                    """, [task, run])
+            except Exception as ex:
+                log.exception()
+                return error(str(ex))
 
-        # TODO: Make sure we got back one row with two columns.
-        row = cursor.fetchone()
-        cursor.close()
+            if cursor.rowcount == 0:
+                cursor.close()
+                return not_found()
 
-        if not wait and row[1] is None:
-            time.sleep(0.25)
-            tries -= 1
-        else:
-            break
+            # TODO: Make sure we got back one row with two columns.
+            row = cursor.fetchone()
+            cursor.close()
 
-    if tries == 0:
-        return not_found()
+            if row[1] is not None:
+                break
+
+            # Don't hold a database connection while waiting.
+            dbcursor_release()
+            if not waiter.wait(deadline):
+                return not_found()
 
 
     test_type, merged_result, test_spec = row
 
+    # A finished run's result doesn't change, so anyone who already
+    # has it can be told so without any further work.
+
+    hashed = result_hash(merged_result)
+    etag = result_etag(run.lower(), hashed, format,
+                       "pretty" if arg_boolean('pretty') else "")
+
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
 
     # JSON requires no formatting.
     if format == 'application/json':
-        return ok_json(merged_result)
-
-    if not merged_result['succeeded']:
+        response = ok_json(merged_result)
+    elif not merged_result['succeeded']:
         if format == 'text/plain':
-            return ok("Test failed.", mimetype=format)
-        elif format == 'text/html':
-            return ok("<p>Test failed.</p>", mimetype=format)
-        return bad_request("Unsupported format " + format)
-
-    formatter_input = {
-        "spec": test_spec,
-        "result": merged_result
-        }
-
-    returncode, stdout, stderr = pscheduler.run_program(
-        [ "pscheduler", "internal", "invoke", "test", test_type,
-          "result-format", format ],
-        stdin = pscheduler.json_dump(formatter_input)
-        )
-
-    if returncode != 0:
-        return error("Failed to format result: " + stderr)
-
-    return ok(stdout.rstrip(), mimetype=format)
+            response = ok("Test failed.", mimetype=format)
+        else:
+            response = ok("<p>Test failed.</p>", mimetype=format)
+    else:
+        succeeded, formatted = result_format(run.lower(), test_type,
+                                             test_spec, merged_result,
+                                             format, hashed)
+        if not succeeded:
+            return error("Failed to format result: " + formatted)
+        response = ok(formatted, mimetype=format)
+
+    response.set_etag(etag)
+    return response
@@ -4,12 +4,14 @@
 
 import pscheduler
 import time
+import uuid
 
 from pschedulerapiserver import application
 
 from flask import request
 
 from .dbcursor import dbcursor_query
+from .dbcursor import dbcursor_stream
 from .json import *
 from .limitproc import *
 from .log import log
@@ -18,7 +20,52 @@ from .tasks import task_exists
 from .util import server_fqdn
 
 
+# Fields that can be asked for in schedule output and the columns
+# needed to produce them.  The JSON-heavy ones are only pulled from the
+# database if wanted.
+schedule_fields = {
+    "start-time": [],
+    "end-time": [],
+    "href": [],
+    "result-href": [],
+    "state": [],
+    "state-display": [],
+    "task": [ "task_json" ],
+    "cli": [ "task_cli" ],
+    "test": [ "test_json" ],
+    "tool": [ "tool_json" ]
+}
+
+schedule_fields_order = [ "start-time", "end-time", "href", "result-href",
+                          "state", "state-display", "task", "cli", "test",
+                          "tool" ]
+
+
+def arg_schedule_after(name):
+    """Fetch and validate a schedule position as TIME,RUN-UUID,
+    returning a tuple of the two or None if not specified."""
+    argval = request.args.get(name)
+    if argval is None:
+        return None
+    try:
+        when, run = argval.rsplit(",", 1)
+        run = str(uuid.UUID(run))
+    except ValueError:
+        raise ValueError("Invalid position; expecting TIME,RUN-UUID")
+    timestamp = pscheduler.iso8601_as_datetime(when)
+    if timestamp is None:
+        raise ValueError("Invalid position time; expecting ISO8601.")
+    return (timestamp, run)
+
+
+
 # Schedule
+#
+# Runs are produced in order of start time and run UUID.  Large
+# schedules can be fetched a page at a time by passing the limit
+# parameter and passing the start time and run UUID of the last run
+# seen as after=TIME,RUN-UUID to get the next page.  The fields
+# parameter limits the output to a comma-separated list of fields.
 @application.route("/schedule", methods=['GET'])
 def schedule():
 
@@ -33,6 +80,22 @@ def schedule():
     except ValueError:
         return bad_request('Invalid task UUID')
 
+    try:
+        after = arg_schedule_after("after")
+        limit = arg_cardinal("limit")
+        fields = arg_fields("fields", schedule_fields)
+    except ValueError as ex:
+        return bad_request(str(ex))
+
+    if fields is None:
+        fields = set(schedule_fields)
+
+    # Columns beyond the basics go at the end.
+    extra_columns = []
+    for field in schedule_fields_order:
+        if field in fields:
+            extra_columns.extend(schedule_fields[field])
+
     query = ["""
             SELECT
                 lower(times),
@@ -40,34 +103,44 @@ def schedule():
                 task,
                 run,
                 state_enum,
-                state_display,
-                task_json,
-                task_cli,
-                test_json,
-                tool_json
+                state_display
+    """]
+    query.extend([ ", " + column for column in extra_columns ])
+    query.append("""
             FROM schedule
             WHERE times && tstzrange(%s, %s, '[)')
-    """]
+    """)
     args = [range_start, range_end]
 
     if task is not None:
         query.append("AND task = %s")
         args.append(task)
 
+    if after is not None:
+        query.append("AND (lower(times), run) > (%s, %s::UUID)")
+        args.extend(after)
+
+    query.append("ORDER BY lower(times), run")
+
+    if limit is not None:
+        query.append("LIMIT %s")
+        args.append(limit)
+
     try:
-        cursor = dbcursor_query(" ".join(query), args)
+        rows = dbcursor_stream(" ".join(query), args)
     except Exception as ex:
         log.exception()
         return error(str(ex))
 
-    result = []
-
     base_url = pscheduler.api_url(server_fqdn(), "tasks/")
-    for row in cursor:
+
+    def transform(row):
 
         task_href = base_url +  row[2]
         run_href = "%s/runs/%s" % (task_href, row[3])
 
+        extras = dict(zip(extra_columns, row[6:]))
+
         run = {
             "start-time": pscheduler.datetime_as_iso8601(row[0]),
             "end-time": pscheduler.datetime_as_iso8601(row[1]),
@@ -75,17 +148,19 @@ def schedule():
             "result-href": "%s/result" % run_href,
             "state": row[4],
             "state-display": row[5],
-            "task": row[6],
-            "cli": row[7],
-            "test": row[8],
-            "tool": row[9]
+            "task": extras.get("task_json"),
+            "cli": extras.get("task_cli"),
+            "test": extras.get("test_json"),
+            "tool": extras.get("tool_json")
             }
 
-        run["task"]["href"] = task_href
+        if run["task"] is not None:
+            run["task"]["href"] = task_href
 
-        result.append(run)
+        return dict([ (key, value) for key, value in run.items()
+                      if key in fields ])
 
-    return ok_json(result)
+    return ok_json_stream(rows, transform)
 
 
 
@@ -8,7 +8,11 @@ from pschedulerapiserver import application
 
 from flask import request
 
+from .canrun import canrun_stats
 from .dbcursor import dbcursor_query
+from .dbcursor import dbcursor_pool_stats
+from .dbnotify import dbnotify_stats
+from .resultcache import resultcache_stats
 from .json import *
 from .response import *
 
@@ -57,6 +61,46 @@ def stat_control_pause():
 
 
 
+#
+# API Server
+#
+
+# Note that this describes only the server process that handles the
+# request.
+
+@application.route("/stat/api/db-pool", methods=['GET'])
+def stat_api_db_pool():
+    try:
+        return ok_json(dbcursor_pool_stats())
+    except Exception as ex:
+        return error(str(ex))
+
+
+@application.route("/stat/api/notify", methods=['GET'])
+def stat_api_notify():
+    try:
+        return ok_json(dbnotify_stats())
+    except Exception as ex:
+        return error(str(ex))
+
+
+@application.route("/stat/api/result-cache", methods=['GET'])
+def stat_api_result_cache():
+    try:
+        return ok_json(resultcache_stats())
+    except Exception as ex:
+        return error(str(ex))
+
+
+@application.route("/stat/api/can-run-cache", methods=['GET'])
+def stat_api_can_run_cache():
+    try:
+        return ok_json(canrun_stats())
+    except Exception as ex:
+        return error(str(ex))
+
+
+
 #
 # Archiving
 #
@@ -3,6 +3,7 @@
 #
 
 import pscheduler
+import time
 import urlparse
 
 # HACK: BWCTLBC
@@ -14,6 +15,7 @@ from flask import request
 
 from .access import *
 from .dbcursor import dbcursor_query
+from .dbcursor import dbcursor_stream
 from .json import *
 from .limitproc import *
 from .log import log
@@ -26,6 +28,44 @@ class TaskPostingException(Exception):
     pass
 
 
+# Most participants talked to at once while posting a task
+TASK_POST_FAN_OUT = 20
+
+# Seconds allowed for each round of talking to participants while
+# posting a task
+TASK_POST_DEADLINE = 30
+
+
+class PhaseTimer(object):
+    """Logs how long each phase of something takes."""
+
+    def __init__(self, what):
+        self.what = what
+        self.start = self.last = time.time()
+
+    def phase(self, name):
+        """Note the end of a phase"""
+        now = time.time()
+        log.debug("%s: %s took %.3f seconds", self.what, name, now - self.last)
+        self.last = now
+
+    def done(self):
+        """Note the end of everything"""
+        log.debug("%s: Done in %.3f seconds", self.what,
+                  time.time() - self.start)
+
+
+def time_left(deadline):
+    """
+    Return the seconds left until a deadline, throwing a
+    TaskPostingException if it's passed.
+    """
+    left = deadline - time.time()
+    if left <= 0:
+        raise TaskPostingException("Ran out of time")
+    return left
+
+
 def task_exists(task):
     """Determine if a task exists by its UUID"""
     try:
@@ -108,45 +148,184 @@ def pick_tool(lists, pick_from=None):
 
 
 
+def participant_tools(participant, tool_params, lead_bind, deadline):
+    """
+    Make sure a participant is running pScheduler and get a list of
+    the tools it has that can run the test.  Returns a tuple of the
+    list and None or None and an error message.  (Not to be used
+    outside this module.)
+    """
+
+    try:
+
+        # Make sure the other participants are running pScheduler
+
+        participant_api = pscheduler.api_url(participant)
+
+        log.debug("Pinging %s" % (participant))
+        status, result = pscheduler.url_get(
+            participant_api, throw=False,
+            timeout=min(10, time_left(deadline)),
+            bind=lead_bind)
+
+        if status == 400:
+            raise TaskPostingException(result)
+        elif status in [ 202, 204, 205, 206, 207, 208, 226,
+                         300, 301, 302, 303, 304, 205, 306, 307, 308 ] \
+            or ( (status >= 400) and (status <=499) ):
+            raise TaskPostingException("Host is not running pScheduler")
+        elif status != 200:
+            raise TaskPostingException("returned status %d: %s"
+                                       % (status, result))
+
+
+        # TODO: This will fail with a very large test spec.
+        status, result = pscheduler.url_get(
+            "%s/tools" % (participant_api),
+            params=tool_params,
+            throw=False,
+            timeout=time_left(deadline),
+            bind=lead_bind
+            )
+        if status != 200:
+            raise TaskPostingException("%d: %s" % (status, result))
+
+    except TaskPostingException as ex:
+        return None, "Error getting tools from %s: %s" % (participant, str(ex))
+
+    log.debug("Participant %s offers tools %s", participant, result)
+    return result, None
+
+
+
+def participant_post(participant, part_name, task_uuid, task_data,
+                     lead_bind, deadline):
+    """
+    Post a task to a participant and fetch the list of limits it
+    passed.  Returns a tuple of the URL the task was posted to, the
+    list of limits passed and None or an error message.  (Not to be
+    used outside this module.)
+    """
+
+    post_url = pscheduler.api_url(part_name, 'tasks/' + task_uuid)
+
+    try:
+
+        # Post the task
+
+        log.debug("Tasking %d@%s: %s", participant, part_name, task_data)
+        log.debug("Posting task to %s", post_url)
+        status, result = pscheduler.url_post(
+            post_url,
+            params={ 'participant': participant },
+            data=task_data,
+            bind=lead_bind,
+            json=False,
+            throw=False,
+            timeout=time_left(deadline))
+        log.debug("Remote returned %d: %s", status, result)
+        if status != 200:
+            raise TaskPostingException("Unable to post task to %s: %s"
+                                       % (part_name, result))
+
+        # Fetch the task's details and the list of limits passed.
+
+        status, result = pscheduler.url_get(post_url,
+                                            params={ "detail": True },
+                                            bind=lead_bind,
+                                            throw=False,
+                                            timeout=time_left(deadline))
+        if status != 200:
+            raise TaskPostingException(
+                "Unable to fetch posted task from %s: %s"
+                % (part_name, result))
+        log.debug("Fetched %s", result)
+        try:
+            details = result["detail"]["spec-limits-passed"]
+            log.debug("Details from %s: %s", post_url, details)
+        except KeyError:
+            details = []
+
+    except TaskPostingException as ex:
+        return post_url, [], "Error while tasking %s: %s" % (part_name, ex)
+
+    return post_url, details, None
+
+
+
 
 @application.route("/tasks", methods=['GET', 'POST'])
 def tasks():
 
     if request.method == 'GET':
 
-        expanded = is_expanded()
+        # Tasks are produced in the order they were added.  Large
+        # lists can be fetched a page at a time by passing the limit
+        # parameter and passing the UUID of the last task seen as
+        # after to get the next page.  When expanded, the fields
+        # parameter limits the task JSON to a comma-separated list of
+        # its top-level pairs.
 
-        query = """
-            SELECT json, uuid
-            FROM task
-            """
-        args = []
+        expanded = is_expanded()
 
         try:
             json_query = arg_json("json")
+            after = arg_uuid("after")
+            limit = arg_cardinal("limit")
+            fields = arg_fields("fields")
         except ValueError as ex:
             return bad_request(str(ex))
 
+        conditions = []
+        args = []
+
+        if not expanded:
+            query = ["SELECT NULL, uuid"]
+        elif fields is None:
+            query = ["SELECT json, uuid"]
+        else:
+            query = ["""SELECT
+                            COALESCE((SELECT jsonb_object_agg(key, value)
+                                      FROM jsonb_each(json)
+                                      WHERE key = ANY(%s)), '{}'::JSONB),
+                            uuid"""]
+            args.append(list(fields))
+
+        query.append("FROM task")
+
         if json_query is not None:
-            query += "WHERE json @> %s"
+            conditions.append("json @> %s")
             args.append(request.args.get("json"))
 
-        query += " ORDER BY added"
+        if after is not None:
+            conditions.append("""(added, id) >
+                (SELECT added, id FROM task WHERE uuid = %s)""")
+            args.append(after)
+
+        if conditions:
+            query.append("WHERE " + " AND ".join(conditions))
+
+        query.append("ORDER BY added, id")
+
+        if limit is not None:
+            query.append("LIMIT %s")
+            args.append(limit)
 
         try:
-            cursor = dbcursor_query(query, args)
+            rows = dbcursor_stream(" ".join(query), args)
         except Exception as ex:
             return error(str(ex))
 
-        result = []
-        for row in cursor:
-            url = base_url(row[1])
+        tasks_url = base_url()
+
+        def transform(row):
+            url = tasks_url + "/" + row[1]
             if not expanded:
-                result.append(url)
-                continue
+                return url
             row[0]['href'] = url
-            result.append(row[0])
-        return json_response(result)
+            return row[0]
+
+        return ok_json_stream(rows, transform)
 
     elif request.method == 'POST':
 
@@ -170,28 +349,6 @@ def tasks():
             return bad_request("Invalid task specification: %s" % (message))
 
 
-        # See if the test spec is valid
-
-        try:
-            returncode, stdout, stderr = pscheduler.run_program(
-                [ "pscheduler", "internal", "invoke", "test",
-                  task['test']['type'], "spec-is-valid" ],
-                stdin = pscheduler.json_dump(task['test']['spec'])
-                )
-
-            if returncode != 0:
-                return error("Unable to validate test spec: %s" % (stderr))
-            # TODO:  #74 Figure out how to schemafy this.
-            validate_json = pscheduler.json_load(stdout)
-            if not validate_json["valid"]:
-                return bad_request("Invalid test specification: %s" %
-                                   (validate_json.get("error", "Unspecified error")))
-        except Exception as ex:
-            return error("Unable to validate test spec: " + str(ex))
-
-        log.debug("Validated test: %s", pscheduler.json_dump(task['test']))
-
-
         # Reject tasks that have archive specs that use transforms.
         # See ticket #330.
 
@@ -204,38 +361,80 @@ def tasks():
 
 
 
-        # Find the participants
+        # See if the test spec is valid and find the participants.
+        # These don't depend on each other, so they're done at the
+        # same time.
 
-        try:
+        timer = PhaseTimer("Task POST")
 
-            # HACK: BWCTLBC
-            if "lead-bind" in task:
-                lead_bind_env = {
-                    "PSCHEDULER_LEAD_BIND_HACK": task["lead-bind"]
-                }
-            else:
-                lead_bind_env = None
+        # HACK: BWCTLBC
+        if "lead-bind" in task:
+            lead_bind_env = {
+                "PSCHEDULER_LEAD_BIND_HACK": task["lead-bind"]
+            }
+        else:
+            lead_bind_env = None
 
+        spec_data = pscheduler.json_dump(task['test']['spec'])
 
-            returncode, stdout, stderr = pscheduler.run_program(
-                [ "pscheduler", "internal", "invoke", "test",
-                  task['test']['type'], "participants" ],
-                stdin = pscheduler.json_dump(task['test']['spec']),
-                timeout=5,
-                env_add=lead_bind_env
-                )
+        # This depends on the request, which the threads can't see.
+        fqdn = server_fqdn()
 
-            if returncode != 0:
-                return error("Unable to determine participants: " + stderr)
+        def validate_spec():
+            """Returns a response if the spec isn't valid, None if it is"""
+            try:
+                returncode, stdout, stderr = pscheduler.run_program(
+                    [ "pscheduler", "internal", "invoke", "test",
+                      task['test']['type'], "spec-is-valid" ],
+                    stdin = spec_data
+                    )
 
-            # TODO:  #74 Figure out how to schemafy this.
-            participants = [ host if host is not None
-                             else server_fqdn()
-                             for host in pscheduler.json_load(stdout)["participants"] ]
-        except Exception as ex:
-            return error("Exception while determining participants: " + str(ex))
+                if returncode != 0:
+                    return error("Unable to validate test spec: %s" % (stderr))
+                # TODO:  #74 Figure out how to schemafy this.
+                validate_json = pscheduler.json_load(stdout)
+                if not validate_json["valid"]:
+                    return bad_request("Invalid test specification: %s" %
+                                       (validate_json.get("error", "Unspecified error")))
+            except Exception as ex:
+                return error("Unable to validate test spec: " + str(ex))
+            return None
+
+        def find_participants():
+            """Returns a tuple of the participants and an error response"""
+            try:
+                returncode, stdout, stderr = pscheduler.run_program(
+                    [ "pscheduler", "internal", "invoke", "test",
+                      task['test']['type'], "participants" ],
+                    stdin = spec_data,
+                    timeout=5,
+                    env_add=lead_bind_env
+                    )
+
+                if returncode != 0:
+                    return None, error("Unable to determine participants: " + stderr)
+
+                # TODO:  #74 Figure out how to schemafy this.
+                return [ host if host is not None
+                         else fqdn
+                         for host in pscheduler.json_load(stdout)["participants"] ], None
+            except Exception as ex:
+                return None, error("Exception while determining participants: " + str(ex))
+
+        spec_response, (participants, participants_response) = \
+            pscheduler.fan_out(lambda function: function(),
+                               [ validate_spec, find_participants ])
+
+        if spec_response is not None:
+            return spec_response
+        log.debug("Validated test: %s", pscheduler.json_dump(task['test']))
+
+        if participants_response is not None:
+            return participants_response
         nparticipants = len(participants)
 
+        timer.phase("Validation and participants")
+
         # TODO: The participants must be unique.  This should be
         # verified by fetching the host name from each one.
 
@@ -248,54 +447,27 @@ def tasks():
         # TODO: Need to provide for tool being specified by the task
         # package.
 
-        tools = []
-
         tool_params={ "test": pscheduler.json_dump(task["test"]) }
         # HACK: BWCTLBC
         if lead_bind is not None:
             log.debug("Using lead bind of %s" % str(lead_bind))
             tool_params["lead-bind"] = lead_bind
 
-        for participant_no in range(0, len(participants)):
-
-            participant = participants[participant_no]
-
-            try:
-
-                # Make sure the other participants are running pScheduler
-
-                participant_api = pscheduler.api_url(participant)
+        deadline = time.time() + TASK_POST_DEADLINE
+        results = pscheduler.fan_out(
+            lambda participant: participant_tools(participant, tool_params,
+                                                  lead_bind, deadline),
+            participants,
+            threads=TASK_POST_FAN_OUT,
+            abort=lambda result: result[1] is not None)
 
-                log.debug("Pinging %s" % (participant))
-                status, result = pscheduler.url_get(
-                    participant_api, throw=False, timeout=10,
-                    bind=lead_bind)
+        for result in results:
+            if result is not None and result[1] is not None:
+                return error(result[1])
 
-                if status == 400:
-                    raise TaskPostingException(result)
-                elif status in [ 202, 204, 205, 206, 207, 208, 226,
-                                 300, 301, 302, 303, 304, 205, 306, 307, 308 ] \
-                    or ( (status >= 400) and (status <=499) ):
-                    raise TaskPostingException("Host is not running pScheduler")
-                elif status != 200:
-                    raise TaskPostingException("returned status %d: %s"
-                                               % (status, result))
+        tools = [ result[0] for result in results ]
 
-
-                # TODO: This will fail with a very large test spec.
-                status, result = pscheduler.url_get(
-                    "%s/tools" % (participant_api),
-                    params=tool_params,
-                    throw=False,
-                    bind=lead_bind
-                    )
-                if status != 200:
-                    raise TaskPostingException("%d: %s" % (status, result))
-                tools.append(result)
-            except TaskPostingException as ex:
-                return error("Error getting tools from %s: %s" \
-                                     % (participant, str(ex)))
-            log.debug("Participant %s offers tools %s", participant, result)
+        timer.phase("Tool lists")
 
         if len(tools) != nparticipants:
             return error("Didn't get a full set of tool responses")
@@ -315,8 +487,6 @@ def tasks():
         # TASK CREATION
         #
 
-        tasks_posted = []
-
         # Evaluate the task against the limits and reject the request
         # if it doesn't pass.
 
@@ -361,66 +531,47 @@ def tasks():
         task["participants"] = participants
         task_data = pscheduler.json_dump(task)
 
-        for participant in range(1,nparticipants):
+        timer.phase("Limits and local post")
+
+        deadline = time.time() + TASK_POST_DEADLINE
+        results = pscheduler.fan_out(
+            lambda participant: participant_post(
+                participant, participants[participant], task_uuid, task_data,
+                lead_bind, deadline),
+            range(1, nparticipants),
+            threads=TASK_POST_FAN_OUT,
+            abort=lambda result: result[2] is not None)
+
+        failures = [ result[2] for result in results
+                     if result is not None and result[2] is not None ]
+
+        if failures:
+
+            # Remove the task from everywhere it was or might have been
+            # posted, which includes those where the outcome isn't
+            # known because the request failed or timed out.
+
+            # TODO: Handle failure?
+            pscheduler.fan_out(
+                lambda url: pscheduler.url_delete(url, throw=False,
+                                                  timeout=5, bind=lead_bind),
+                [ result[0] for result in results if result is not None ],
+                threads=TASK_POST_FAN_OUT)
 
-            part_name = participants[participant]
-            log.debug("Tasking participant %s", part_name)
             try:
+                dbcursor_query("SELECT api_task_delete(%s)", [task_uuid])
+            except Exception as ex:
+                log.exception()
+
+            timer.phase("Rollback")
+            timer.done()
+            return error(failures[0])
 
-                # Post the task
-
-                log.debug("Tasking %d@%s: %s", participant, part_name, task_data)
-                post_url = pscheduler.api_url(part_name,
-                                              'tasks/' + task_uuid)
-                log.debug("Posting task to %s", post_url)
-                status, result = pscheduler.url_post(
-                    post_url,
-                    params={ 'participant': participant },
-                    data=task_data,
-                    bind=lead_bind,
-                    json=False,
-                    throw=False)
-                log.debug("Remote returned %d: %s", status, result)
-                if status != 200:
-                    raise TaskPostingException("Unable to post task to %s: %s"
-                                               % (part_name, result))
-                tasks_posted.append(result)
-
-                # Fetch the task's details and add the list of limits
-                # passed to our own.
-
-                status, result = pscheduler.url_get(post_url,
-                                                    params={ "detail": True },
-                                                    bind=lead_bind,
-                                                    throw=False)
-                if status != 200:
-                    raise TaskPostingException(
-                        "Unable to fetch posted task from %s: %s"
-                        % (part_name, result))
-                log.debug("Fetched %s", result)
-                try:
-                    details = result["detail"]["spec-limits-passed"]
-                    log.debug("Details from %s: %s", post_url, details)
-                    limits_passed.extend(details)
-                except KeyError:
-                    pass
-
-            except TaskPostingException as ex:
-
-                for url in tasks_posted:
-                    # TODO: Handle failure?
-                    status, result = pscheduler.url_delete(url,
-                                                           throw=False, 
-                                                           timeout=5,
-                                                           bind=lead_bind)
-
-                    try:
-                        dbcursor_query("SELECT api_task_delete(%s)",
-                                       [task_uuid])
-                    except Exception as ex:
-                        log.exception()
-
-                return error("Error while tasking %s: %s" % (part_name, ex))
+        # Add the lists of limits passed to our own.
+        for result in results:
+            limits_passed.extend(result[1])
+
+        timer.phase("Participant posts")
 
 
         # Update the list of limits passed in the local database
@@ -443,6 +594,9 @@ def tasks():
             return error("Failed to enable task %s.  See system logs." % task_uuid)
         log.debug("Task enabled for scheduling.")
 
+        timer.phase("Enable")
+        timer.done()
+
         return ok_json("%s/%s" % (request.base_url, task_uuid))
 
     else:
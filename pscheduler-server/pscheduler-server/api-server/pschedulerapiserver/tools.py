@@ -8,6 +8,7 @@ from pschedulerapiserver import application
 
 from flask import request
 
+from .canrun import canrun_tools_for_test
 from .dbcursor import dbcursor_query
 from .json import *
 from .log import log
@@ -28,13 +29,12 @@ def tools():
         log.debug("Looking for tools against filter %s", test_filter)
         lead_bind = request.args.get('lead-bind', None)  # HACK: BWCTLBC
         try:
-            cursor = dbcursor_query("SELECT api_tools_for_test(%s, %s)",
-                                    [test_filter,
-                                     lead_bind],  # HACK: BWTCLBC
-                                    onerow=True)
+            test = pscheduler.json_load(test_filter)
+            tools = canrun_tools_for_test(test, lead_bind)  # HACK: BWTCLBC
         except Exception as ex:
             return error(str(ex))
-        return ok_json( cursor.fetchone()[0] )
+        # This has historically been null rather than an empty list.
+        return ok_json(tools if tools else None)
 
 
 @application.route("/tools/<name>", methods=['GET'])
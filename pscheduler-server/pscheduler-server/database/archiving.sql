@@ -118,6 +118,40 @@ BEGIN
         t_version := t_version + 1;
     END IF;
 
+    -- Version 5 to version 6
+    -- Adds leases so more than one archiver can work at once
+    IF t_version = 5
+    THEN
+        -- When the archiver that claimed this archiving is presumed
+        -- to have gone away.  NULL if not claimed.
+        ALTER TABLE archiving ADD COLUMN
+        lease_expires TIMESTAMP WITH TIME ZONE;
+
+        t_version := t_version + 1;
+    END IF;
+
+    -- Version 6 to version 7
+    -- Counts diagnostics dropped to keep the list short
+    IF t_version = 6
+    THEN
+        ALTER TABLE archiving ADD COLUMN
+        diags_dropped INTEGER DEFAULT 0 CHECK (diags_dropped >= 0);
+
+        t_version := t_version + 1;
+    END IF;
+
+    -- Version 7 to version 8
+    -- Has autovacuum keep up with rows removed as runs are purged.
+    IF t_version = 7
+    THEN
+        ALTER TABLE archiving SET (
+            autovacuum_vacuum_scale_factor = 0.02,
+            autovacuum_analyze_scale_factor = 0.02
+        );
+
+        t_version := t_version + 1;
+    END IF;
+
 
     --
     -- Cleanup
@@ -254,13 +288,68 @@ DROP FUNCTION IF EXISTS archiving_alter();
 
 
 
--- Return the first max_return items eligible for archiving
+-- Append diagnostics to an archiving's list, keeping only the most
+-- recent ones.  Anything that updates diags should also add what
+-- archiving_diags_overflow() returns to diags_dropped.
+
+CREATE OR REPLACE FUNCTION archiving_diags_append(
+    diags JSONB,
+    new_diags JSONB,
+    keep INTEGER
+)
+RETURNS JSONB
+AS $$
+DECLARE
+    combined JSONB;
+    drop_count INTEGER;
+BEGIN
+    combined := COALESCE(diags, '[]'::JSONB) || new_diags;
+    drop_count := jsonb_array_length(combined) - keep;
+
+    IF drop_count <= 0
+    THEN
+        RETURN combined;
+    END IF;
+
+    RETURN (
+        SELECT jsonb_agg(element ORDER BY position)
+        FROM jsonb_array_elements(combined)
+            WITH ORDINALITY AS elements (element, position)
+        WHERE position > drop_count
+    );
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+-- How many diagnostics archiving_diags_append() will drop
+
+CREATE OR REPLACE FUNCTION archiving_diags_overflow(
+    diags JSONB,
+    new_diags JSONB,
+    keep INTEGER
+)
+RETURNS INTEGER
+AS $$
+BEGIN
+    RETURN greatest(jsonb_array_length(COALESCE(diags, '[]'::JSONB))
+                    + jsonb_array_length(new_diags) - keep, 0);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+
+
+-- Claim and return the first max_return items eligible for
+-- archiving.  Claimed items are not returned again until the lease
+-- runs out, which allows multiple archivers to work without
+-- duplicating each other's efforts.  Whatever records the outcome of
+-- an attempt should set lease_expires to NULL.
 
 -- TODO: Can remove this after GA release.
 DROP FUNCTION IF EXISTS archiving_next(INTEGER);
 
 CREATE OR REPLACE FUNCTION archiving_next(
-    max_return INTEGER
+    max_return INTEGER,
+    lease INTERVAL DEFAULT 'PT10M'
 )
 RETURNS TABLE (
     id BIGINT,
@@ -282,6 +371,25 @@ BEGIN
 
     RETURN QUERY
 
+    WITH claimed AS (
+        UPDATE archiving
+        SET lease_expires = now() + lease
+        WHERE archiving.id IN (
+            SELECT candidate.id FROM archiving candidate
+            WHERE
+                NOT candidate.archived
+                AND candidate.next_attempt IS NOT NULL
+                AND candidate.next_attempt < now()
+                AND (candidate.ttl_expires IS NULL
+                     OR candidate.ttl_expires > now())
+                AND (candidate.lease_expires IS NULL
+                     OR candidate.lease_expires < now())
+            ORDER BY candidate.attempts, candidate.next_attempt
+            LIMIT max_return
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING archiving.id
+    )
     SELECT
         archiving.id AS id,
         task.uuid AS task_uuid,
@@ -297,23 +405,13 @@ BEGIN
         archiving.attempts AS attempts,
         archiving.last_attempt AS last_attempt
     FROM
-        archiving
+        claimed
+        JOIN archiving ON archiving.id = claimed.id
         JOIN archiver ON archiver.id = archiving.archiver
         JOIN run ON run.id = archiving.run
         JOIN task ON task.id = run.task
         JOIN tool ON tool.id = task.tool
-    WHERE
-        archiving.id IN (
-            SELECT archiving.id FROM archiving
-            WHERE
-                NOT archived
-                AND next_attempt IS NOT NULL
-                AND next_attempt < now()
-                AND (ttl_expires IS NULL OR ttl_expires > now())
-            ORDER BY archiving.attempts, next_attempt
-            LIMIT max_return
-        )
-    ORDER BY attempts, next_attempt;
+    ORDER BY archiving.attempts, archiving.next_attempt;
 
     RETURN;
 
@@ -321,6 +419,7 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+
 -- A handy view for the archiver to use
 
 -- TODO: Remove this after GA release
@@ -372,7 +471,8 @@ BEGIN
             archiving.archiver_data AS archiver_data,
             archiving.archived AS archived,
             archiving.last_attempt AS last_attempt,
-            archiving.diags AS diags
+            archiving.diags AS diags,
+            archiving.diags_dropped AS diags_dropped
         FROM
             archiving
             JOIN archiver ON archiver.id = archiving.archiver
@@ -393,12 +493,16 @@ $$ LANGUAGE plpgsql;
 -- Maintenance functions
 
 
+-- TODO: Can remove this after GA release.
+DROP FUNCTION IF EXISTS archiving_maint_minute();
+
 CREATE OR REPLACE FUNCTION archiving_maint_minute()
-RETURNS VOID
+RETURNS INTEGER
 AS $$
 DECLARE
     diag JSONB;
     default_next_attempt TIMESTAMP WITH TIME ZONE;
+    expired INTEGER;
 BEGIN
 
     -- Force archivings that have seen no attempts by their TTL into a
@@ -414,10 +518,18 @@ BEGIN
     SET
         archived = TRUE,     -- Not really, but gets the attempt off the table.
         next_attempt = NULL,
-        diags = diags || diag::JSONB
+        diags = archiving_diags_append(archiving.diags, jsonb_build_array(diag),
+                                       configurables.archiving_diags),
+        diags_dropped = archiving.diags_dropped
+            + archiving_diags_overflow(archiving.diags, jsonb_build_array(diag),
+                                       configurables.archiving_diags)
+    FROM configurables
     WHERE
         NOT archived
         AND ttl_expires < now();
+    GET DIAGNOSTICS expired = ROW_COUNT;
+
+    RETURN expired;
 
 END;
 $$ LANGUAGE plpgsql;
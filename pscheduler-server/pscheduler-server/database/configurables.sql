@@ -79,6 +79,16 @@ BEGIN
         t_version := t_version + 1;
     END IF;
 
+    -- Version 4 to version 5
+    IF t_version = 4
+    THEN
+        ALTER TABLE configurables ADD COLUMN
+        -- Most attempt diagnostics kept for each archiving
+        archiving_diags INTEGER DEFAULT 10 CHECK (archiving_diags > 0);
+
+        t_version := t_version + 1;
+    END IF;
+
 
     --
     -- Cleanup
@@ -111,6 +111,19 @@ BEGIN
     END IF;
 
 
+    -- Version 3 to version 4
+    -- Adds 'lease_expires' column and an index for finding what's due
+    IF t_version = 3
+    THEN
+        ALTER TABLE http_queue ADD COLUMN
+        lease_expires TIMESTAMP WITH TIME ZONE NULL;
+
+        CREATE INDEX http_queue_next_attempt ON http_queue(next_attempt);
+
+        t_version := t_version + 1;
+    END IF;
+
+
     --
     -- Cleanup
     --
@@ -121,7 +134,10 @@ END;
 $$ LANGUAGE plpgsql;
 
 
--- Process one item in the table by its row ID
+-- Process one item in the table by its row ID.  Normal operation
+-- has the ticker deliver queued operations outside the database (see
+-- http_queue_next() and http_queue_record() below); this is here for
+-- manual use.
 
 CREATE OR REPLACE FUNCTION http_queue_process(
     row_id BIGINT
@@ -174,7 +190,8 @@ BEGIN
  	    last_status = status.status,
  	    last_returned = status.returned,
             last_attempt = now(),
-            next_attempt = now() + entry.try_interval
+            next_attempt = now() + entry.try_interval,
+            lease_expires = NULL
         WHERE id = row_id;
     END IF;
  
@@ -187,7 +204,99 @@ RETURNS VOID
 AS $$
 BEGIN
     PERFORM http_queue_process(id) FROM http_queue
-    WHERE next_attempt < now() OR attempts = 0;
+    WHERE
+        (next_attempt < now() OR attempts = 0)
+        AND (lease_expires IS NULL OR lease_expires < now());
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Claim and return up to max_return operations that are due.  Claimed
+-- operations are not returned again until the lease plus the
+-- operation's timeout runs out, so a deliverer that goes away without
+-- recording an outcome doesn't lose anything.
+
+CREATE OR REPLACE FUNCTION http_queue_next(
+    max_return INTEGER,
+    lease INTERVAL DEFAULT 'PT1M'
+)
+RETURNS TABLE (
+    id BIGINT,
+    operation TEXT,
+    uri TEXT,
+    payload TEXT,
+    timeout FLOAT,
+    bind TEXT
+)
+AS $$
+BEGIN
+
+    RETURN QUERY
+    UPDATE http_queue
+    SET lease_expires = now() + lease
+        + coalesce(http_queue.timeout, 'PT0S'::INTERVAL)
+    WHERE http_queue.id IN (
+        SELECT candidate.id FROM http_queue candidate
+        WHERE
+            (candidate.next_attempt < now() OR candidate.attempts = 0)
+            AND (candidate.lease_expires IS NULL
+                 OR candidate.lease_expires < now())
+        ORDER BY candidate.next_attempt
+        LIMIT max_return
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING
+        http_queue.id,
+        http_queue.operation,
+        http_queue.uri,
+        http_queue.payload,
+        extract('epoch' FROM http_queue.timeout)::FLOAT,
+        http_queue.bind;
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Record the outcomes of delivering claimed operations.  The outcomes
+-- are a JSON array of objects, each with the 'id' of the row, the HTTP
+-- 'status' and what was 'returned'.  Succeeded and expired operations
+-- are removed and the rest are set up for another attempt.
+
+CREATE OR REPLACE FUNCTION http_queue_record(
+    outcomes JSONB
+)
+RETURNS VOID
+AS $$
+BEGIN
+
+    WITH outcome AS (
+        SELECT * FROM jsonb_to_recordset(outcomes)
+            AS outcome (id BIGINT, status INTEGER, returned TEXT)
+    ),
+    finished AS (
+        DELETE FROM http_queue
+        USING outcome
+        WHERE
+            http_queue.id = outcome.id
+            AND ((outcome.status / 100) IN (1, 2, 3)
+                 OR now() + http_queue.try_interval > http_queue.expires)
+        RETURNING http_queue.id
+    )
+    UPDATE http_queue
+    SET
+        attempts = http_queue.attempts + 1,
+        last_status = outcome.status,
+        last_returned = outcome.returned,
+        last_attempt = now(),
+        next_attempt = now() + http_queue.try_interval,
+        lease_expires = NULL
+    FROM outcome
+    WHERE
+        http_queue.id = outcome.id
+        AND outcome.id NOT IN (SELECT finished.id FROM finished);
+
 END;
 $$ LANGUAGE plpgsql;
 
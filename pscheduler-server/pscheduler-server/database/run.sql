@@ -169,6 +169,79 @@ BEGIN
     END IF;
 
 
+    -- Version 6 to version 7
+    -- Copies scheduling information from the task and test so
+    -- conflict checks and straggler sweeps don't need joins.
+    IF t_version = 6
+    THEN
+        -- Scheduling class of the test at the time the run was added
+        ALTER TABLE run ADD COLUMN
+        scheduling_class INTEGER REFERENCES scheduling_class(id);
+
+        -- Whether the run's scheduling class can run any time
+        ALTER TABLE run ADD COLUMN
+        anytime BOOLEAN;
+
+        -- Whether the run's scheduling class requires exclusivity
+        ALTER TABLE run ADD COLUMN
+        exclusive BOOLEAN;
+
+        -- Duration of the task
+        ALTER TABLE run ADD COLUMN
+        duration INTERVAL;
+
+        -- Which participant this system is in the task
+        ALTER TABLE run ADD COLUMN
+        participant INTEGER;
+
+        -- The existing run_alter() doesn't allow for this.
+        ALTER TABLE run DISABLE TRIGGER USER;
+
+        UPDATE run
+        SET
+            scheduling_class = test.scheduling_class,
+            anytime = scheduling_class.anytime,
+            exclusive = scheduling_class.exclusive,
+            duration = task.duration,
+            participant = task.participant
+        FROM
+            task
+            JOIN test ON test.id = task.test
+            JOIN scheduling_class ON scheduling_class.id = test.scheduling_class
+        WHERE task.id = run.task;
+
+        ALTER TABLE run ENABLE TRIGGER USER;
+
+        -- Runs that others might conflict with
+        CREATE INDEX run_conflictable_times ON run USING GIST (times)
+        WHERE NOT anytime AND state <> run_state_nonstart();
+
+        -- Runs that every other non-background run must avoid
+        CREATE INDEX run_exclusive_times ON run USING GIST (times)
+        WHERE exclusive AND state <> run_state_nonstart();
+
+        -- Runs that might become stragglers
+        CREATE INDEX run_unstarted ON run(lower(times), scheduling_class)
+        WHERE state IN (run_state_pending(), run_state_on_deck());
+
+        t_version := t_version + 1;
+    END IF;
+
+
+    -- Version 7 to version 8
+    -- Has autovacuum keep up with the steady trickle of purged runs
+    -- instead of waiting for a fifth of the table to be dead.
+    IF t_version = 7
+    THEN
+        ALTER TABLE run SET (
+            autovacuum_vacuum_scale_factor = 0.02,
+            autovacuum_analyze_scale_factor = 0.02
+        );
+
+        t_version := t_version + 1;
+    END IF;
+
+
     --
     -- Cleanup
     --
@@ -187,19 +260,11 @@ $$ LANGUAGE plpgsql;
 DROP VIEW IF EXISTS run_conflictable;
 CREATE OR REPLACE VIEW run_conflictable
 AS
-    SELECT
-        run.*,
-        task.duration,
-        scheduling_class.anytime,
-        scheduling_class.exclusive
-    FROM
-        run
-        JOIN task ON task.id = run.task
-	JOIN test ON test.id = task.test
-        JOIN scheduling_class ON scheduling_class.id = test.scheduling_class
+    SELECT run.*
+    FROM run
     WHERE
         run.state <> run_state_nonstart()
-        AND NOT scheduling_class.anytime
+        AND NOT run.anytime
 ;
 
 
@@ -242,15 +307,27 @@ BEGIN
     proposed_times := tstzrange(proposed_start,
         proposed_start + taskrec.duration, '[)');
 
-    RETURN ( 
+    -- These are written to match the partial indexes on run.
+
+    IF taskrec.exclusive
+    THEN
         -- Exclusive can't collide with anything
-        ( taskrec.exclusive
-          AND EXISTS (SELECT * FROM run_conflictable
-                      WHERE times && proposed_times) )
-        -- Non-exclusive can't collide with exclusive
-          OR ( NOT taskrec.exclusive
-               AND EXISTS (SELECT * FROM run_conflictable
-                           WHERE exclusive AND times && proposed_times) )
+        RETURN EXISTS (
+            SELECT * FROM run
+            WHERE
+                times && proposed_times
+                AND NOT anytime
+                AND state <> run_state_nonstart()
+            );
+    END IF;
+
+    -- Non-exclusive can't collide with exclusive
+    RETURN EXISTS (
+        SELECT * FROM run
+        WHERE
+            times && proposed_times
+            AND exclusive
+            AND state <> run_state_nonstart()
         );
 
 END;
@@ -266,10 +343,6 @@ AS $$
 DECLARE
     horizon INTERVAL;
     taskrec RECORD;
-    tool_name TEXT;
-    run_result external_program_result;
-    pdata_out JSONB;
-    result_merge_input JSONB;
 BEGIN
 
     -- TODO: What changes to a run don't we allow?
@@ -299,6 +372,24 @@ BEGIN
     END IF;
 
 
+    -- Scheduling information is copied from the task and test when
+    -- the run is added and stays that way.
+
+    IF TG_OP = 'INSERT' THEN
+        NEW.scheduling_class := taskrec.scheduling_class;
+        NEW.anytime := taskrec.anytime;
+        NEW.exclusive := taskrec.exclusive;
+        NEW.duration := taskrec.duration;
+        NEW.participant := taskrec.participant;
+    ELSE
+        NEW.scheduling_class := OLD.scheduling_class;
+        NEW.anytime := OLD.anytime;
+        NEW.exclusive := OLD.exclusive;
+        NEW.duration := OLD.duration;
+        NEW.participant := OLD.participant;
+    END IF;
+
+
 
     -- Non-background gets bounced if trying to schedule beyond the
     -- scheduling horizon.
@@ -365,28 +456,17 @@ BEGIN
 	-- TODO: Make sure part_data_full, result_ful and
 	-- result_merged happen in the right order.
 
-	NOTIFY run_change;
+	-- The run's UUID lets anything waiting on a specific run
+	-- ignore changes to others.
+	PERFORM pg_notify('run_change', NEW.uuid::TEXT);
 
     END IF;
 
 
     -- TODO: When there's resource management, assign the resources to this run.
 
-    SELECT INTO tool_name name FROM tool WHERE id = taskrec.tool; 
-
-    -- Finished runs are what get inserted for background tasks.
-    IF TG_OP = 'INSERT' AND NEW.state <> run_state_finished() THEN
-
-        pdata_out := row_to_json(t) FROM ( SELECT taskrec.participant AS participant,
-                                           cast ( taskrec.json #>> '{test, spec}' AS json ) AS test ) t;
-
-        run_result := pscheduler_internal(ARRAY['invoke', 'tool', tool_name, 'participant-data'], pdata_out::TEXT );
-        IF run_result.status <> 0 THEN
-	    RAISE EXCEPTION 'Unable to get participant data: %', run_result.stderr;
-	END IF;
-        NEW.part_data := regexp_replace(run_result.stdout, '\s+$', '')::JSONB;
-
-    END IF;
+    -- Participant data and merged results come from the tool and are
+    -- filled in after the fact.  See run_deferred.
 
     IF (TG_OP = 'UPDATE') THEN
 
@@ -427,32 +507,18 @@ BEGIN
         END IF;
 
 
-	-- If the full result changed, update the merged version.
-
-       IF NEW.result_full IS NOT NULL
-          AND COALESCE(NEW.result_full::TEXT, '')
-	      <> COALESCE(OLD.result_full::TEXT, '') THEN
-
-	       result_merge_input := row_to_json(t) FROM (
-	           SELECT 
-		       taskrec.json -> 'test' AS test,
-                       NEW.result_full AS results
-                   ) t;
+	-- If the full result goes away, so does the merged version.
+	-- Changes to the full result are merged by run_deferred.
 
- 	       run_result := pscheduler_internal(ARRAY['invoke', 'tool', tool_name,
-	           'merged-results'], result_merge_input::TEXT );
-   	       IF run_result.status <> 0 THEN
-                   -- TODO: This leaves the result empty.  Maybe post some sort of failure?
-	           RAISE EXCEPTION 'Unable to get merged result on %: %',
-		       result_merge_input::TEXT, run_result.stderr;
-	       END IF;
-  	      NEW.result_merged := regexp_replace(run_result.stdout, '\s+$', '')::JSONB;
+        IF NEW.result_full IS NULL THEN
 
-	      NOTIFY result_available;
+            NEW.result_merged := NULL;
 
-        ELSIF NEW.result_full IS NULL THEN
+        ELSIF NEW.result_merged IS NOT NULL
+            AND COALESCE(NEW.result_merged::TEXT, '')
+                <> COALESCE(OLD.result_merged::TEXT, '') THEN
 
-            NEW.result_merged := NULL;
+	    PERFORM pg_notify('result_available', NEW.uuid::TEXT);
 
         END IF;
 
@@ -540,12 +606,20 @@ CREATE TRIGGER run_horizon_change AFTER UPDATE ON configurables
 
 -- Maintenance functions
 
+-- Mark runs that didn't start or finish on time, returning the
+-- number changed.
+
+-- TODO: Can remove this after GA release.
+DROP FUNCTION IF EXISTS run_handle_stragglers();
+
 CREATE OR REPLACE FUNCTION run_handle_stragglers()
-RETURNS VOID
+RETURNS INTEGER
 AS $$
 DECLARE
     straggle_time TIMESTAMP WITH TIME ZONE;
     straggle_time_bg_multi TIMESTAMP WITH TIME ZONE;
+    missed INTEGER;
+    overdue INTEGER;
 BEGIN
 
     -- When non-background-multi tasks are considered tardy
@@ -559,30 +633,24 @@ BEGIN
     -- Runs that failed to start
     UPDATE run
     SET state = run_state_missed()
-    WHERE id IN (
-        SELECT
-            run.id
-        FROM
-            run
-            JOIN task ON task.id = run.task
-            JOIN test ON test.id = task.test
-        WHERE
+    WHERE
+        run.state IN ( run_state_pending(), run_state_on_deck() )
+        AND (
 
             -- Non-background-multi runs pending on deck after start times
             -- were missed
-            ( test.scheduling_class <> scheduling_class_background_multi()
+            ( scheduling_class <> scheduling_class_background_multi()
               AND lower(times) < straggle_time
-              AND run.state IN ( run_state_pending(), run_state_on_deck() )
             )
 
             OR
 
             -- Background-multi runs that passed their end time
-            ( test.scheduling_class = scheduling_class_background_multi()
+            ( scheduling_class = scheduling_class_background_multi()
               AND upper(times) < straggle_time_bg_multi
-              AND run.state IN ( run_state_pending(), run_state_on_deck() )
             )
-    );
+        );
+    GET DIAGNOSTICS missed = ROW_COUNT;
 
 
     -- Runs that started and didn't report back in a timely manner
@@ -591,36 +659,55 @@ BEGIN
     WHERE
         upper(times) < straggle_time
         AND state = run_state_running();
+    GET DIAGNOSTICS overdue = ROW_COUNT;
+
+    RETURN missed + overdue;
 
 END;
 $$ LANGUAGE plpgsql;
 
 
 
-CREATE OR REPLACE FUNCTION run_purge()
-RETURNS VOID
+-- Remove old runs.  Each call removes no more than max_purge of them,
+-- oldest first, so catching up after downtime or a change to
+-- keep_runs_tasks happens over several calls instead of in one large
+-- cascading delete.  Returns the number removed.
+
+-- TODO: Can remove this after GA release.
+DROP FUNCTION IF EXISTS run_purge();
+DROP FUNCTION IF EXISTS run_purge(INTEGER);
+
+CREATE OR REPLACE FUNCTION run_purge(
+    max_purge INTEGER DEFAULT 5000
+)
+RETURNS INTEGER
 AS $$
 DECLARE
     purge_before TIMESTAMP WITH TIME ZONE;
+    purged INTEGER;
 BEGIN
 
-    -- Most runs
     SELECT INTO purge_before now() - keep_runs_tasks FROM configurables;
-    DELETE FROM run
-    WHERE
-        upper(times) < purge_before
-        AND state NOT IN (run_state_pending(),
-                          run_state_on_deck(),
-                          run_state_running());
 
-    -- Extra margin for anything that might actually be running
-    purge_before := purge_before - 'PT1H'::INTERVAL;
     DELETE FROM run
-    WHERE
-        upper(times) < purge_before
-        AND state IN (run_state_pending(),
-                      run_state_on_deck(),
-                      run_state_running());
+    WHERE id IN (
+        SELECT id FROM run
+        WHERE
+            upper(times) < purge_before
+            AND (
+                -- Most runs
+                state NOT IN (run_state_pending(),
+                              run_state_on_deck(),
+                              run_state_running())
+                -- Extra margin for anything that might actually be running
+                OR upper(times) < purge_before - 'PT1H'::INTERVAL
+            )
+        ORDER BY upper(times)
+        LIMIT max_purge
+    );
+    GET DIAGNOSTICS purged = ROW_COUNT;
+
+    RETURN purged;
 
 END;
 $$ LANGUAGE plpgsql;
@@ -0,0 +1,133 @@
+--
+-- Table of times when the schedule is busy.  Each run that other
+-- runs might have to avoid (anything not background that started or
+-- may still start) has a row here.  This keeps the search for free
+-- time in api_proposed_times() from having to sift through every run
+-- and join it to its scheduling class.
+--
+
+DO $$
+DECLARE
+    t_name TEXT;            -- Name of the table being worked on
+    t_version INTEGER;      -- Current version of the table
+    t_version_old INTEGER;  -- Version of the table at the start
+BEGIN
+
+    --
+    -- Preparation
+    --
+
+    t_name := 'run_busy';
+
+    t_version := table_version_find(t_name);
+    t_version_old := t_version;
+
+
+    --
+    -- Upgrade Blocks
+    --
+
+    -- Version 0 (nonexistant) to version 1
+    IF t_version = 0
+    THEN
+
+        CREATE TABLE run_busy (
+
+        	-- Run occupying the time
+        	run		BIGINT
+        			PRIMARY KEY
+        			REFERENCES run(id)
+        			ON DELETE CASCADE,
+
+        	-- Range of times occupied
+        	times		TSTZRANGE
+        			NOT NULL,
+
+        	-- Whether or not the run is exclusive.  Runs that
+        	-- aren't are normal.
+        	exclusive	BOOLEAN
+        			NOT NULL,
+
+        	-- Exclusive runs can never overlap each other.  This
+        	-- also accelerates range-specific operators like &&.
+        	EXCLUDE USING GIST (times WITH &&) WHERE (exclusive)
+        );
+
+        CREATE INDEX run_busy_times ON run_busy USING GIST (times);
+
+        -- Populate the table from existing runs
+
+        INSERT INTO run_busy (run, times, exclusive)
+        SELECT run.id, run.times, run.exclusive
+        FROM run
+        WHERE
+            run.state <> run_state_nonstart()
+            AND NOT run.anytime
+        ON CONFLICT DO NOTHING;
+
+	t_version := t_version + 1;
+
+    END IF;
+
+
+    -- Version 1 to version 2
+    -- IF t_version = 1
+    -- THEN
+    --
+    --    t_version := t_version + 1;
+    --END IF;
+
+
+    --
+    -- Cleanup
+    --
+
+    PERFORM table_version_set(t_name, t_version, t_version_old);
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Keep the table current as runs come and go.  Deletions are handled
+-- by the cascade.
+
+DROP TRIGGER IF EXISTS run_busy_insert ON run;
+DROP TRIGGER IF EXISTS run_busy_update ON run;
+
+CREATE OR REPLACE FUNCTION run_busy_update()
+RETURNS TRIGGER
+AS $$
+BEGIN
+
+    IF TG_OP = 'UPDATE' THEN
+
+        IF NEW.state = run_state_nonstart() THEN
+            DELETE FROM run_busy WHERE run = NEW.id;
+        ELSIF NEW.times <> OLD.times THEN
+            UPDATE run_busy SET times = NEW.times WHERE run = NEW.id;
+        END IF;
+
+        RETURN NEW;
+
+    END IF;
+
+    -- Insertions
+
+    IF NEW.state <> run_state_nonstart() AND NOT NEW.anytime THEN
+        INSERT INTO run_busy (run, times, exclusive)
+        VALUES (NEW.id, NEW.times, NEW.exclusive);
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER run_busy_insert AFTER INSERT ON run
+    FOR EACH ROW EXECUTE PROCEDURE run_busy_update();
+
+CREATE TRIGGER run_busy_update AFTER UPDATE ON run
+    FOR EACH ROW
+    WHEN (OLD.times IS DISTINCT FROM NEW.times
+          OR OLD.state IS DISTINCT FROM NEW.state)
+    EXECUTE PROCEDURE run_busy_update();
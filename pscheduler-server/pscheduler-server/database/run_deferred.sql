@@ -0,0 +1,283 @@
+--
+-- Deferred Run Work
+--
+
+-- This table holds tool method invocations needed to fill in parts
+-- of runs (participant data and merged results).  These used to be
+-- done in the run table's trigger, which meant starting a program
+-- while holding locks on the run.  Rows are added by the trigger and
+-- worked off in batches by the rundata daemon.
+
+DO $$
+DECLARE
+    t_name TEXT;            -- Name of the table being worked on
+    t_version INTEGER;      -- Current version of the table
+    t_version_old INTEGER;  -- Version of the table at the start
+BEGIN
+
+    --
+    -- Preparation
+    --
+
+    t_name := 'run_deferred';
+
+    t_version := table_version_find(t_name);
+    t_version_old := t_version;
+
+
+    --
+    -- Upgrade Blocks
+    --
+
+    -- Version 0 (nonexistant) to version 1
+    IF t_version = 0
+    THEN
+
+        CREATE TABLE run_deferred (
+
+        	-- Row identifier
+        	id		BIGSERIAL
+        			PRIMARY KEY,
+
+        	-- Run needing the work
+        	run		BIGINT
+        			REFERENCES run(id)
+        			ON DELETE CASCADE,
+
+        	-- Tool method to invoke
+        	method		TEXT
+        			NOT NULL
+        			CHECK (method IN ('participant-data',
+        			                  'merged-results')),
+
+        	-- Name of the tool providing the method
+        	tool		TEXT
+        			NOT NULL,
+
+        	-- What goes to the method's standard input
+        	input		JSONB
+        			NOT NULL,
+
+        	-- When added
+        	added		TIMESTAMP WITH TIME ZONE
+        			DEFAULT now()
+        );
+
+        -- Work is done in order of arrival
+        CREATE INDEX run_deferred_added ON run_deferred(added, id);
+
+        -- Used for cascading deletes and finding pending work for a run
+        CREATE INDEX run_deferred_run ON run_deferred(run, method);
+
+	t_version := t_version + 1;
+
+    END IF;
+
+
+    --
+    -- Cleanup
+    --
+
+    PERFORM table_version_set(t_name, t_version, t_version_old);
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+
+-- Queue up work when runs are added or their full results change.
+-- This is done after the fact so the run has an ID to reference.
+
+DROP TRIGGER IF EXISTS run_deferred_run_after ON run CASCADE;
+
+CREATE OR REPLACE FUNCTION run_deferred_run_after()
+RETURNS TRIGGER
+AS $$
+DECLARE
+    taskrec RECORD;
+BEGIN
+
+    IF NOT (
+           -- Finished runs are what get inserted for background tasks.
+           ( TG_OP = 'INSERT'
+             AND NEW.state <> run_state_finished()
+             AND NEW.part_data IS NULL )
+           OR ( TG_OP = 'UPDATE'
+                AND NEW.result_full IS NOT NULL
+                AND COALESCE(NEW.result_full::TEXT, '')
+                    <> COALESCE(OLD.result_full::TEXT, '') )
+       )
+    THEN
+        RETURN NEW;
+    END IF;
+
+    SELECT INTO taskrec
+        task.participant,
+        task.json,
+        tool.name AS tool_name
+    FROM
+        task
+        JOIN tool ON tool.id = task.tool
+    WHERE
+        task.id = NEW.task;
+
+    IF TG_OP = 'INSERT' THEN
+
+        INSERT INTO run_deferred (run, method, tool, input)
+        VALUES (
+            NEW.id,
+            'participant-data',
+            taskrec.tool_name,
+            row_to_json(t) FROM (
+                SELECT
+                    taskrec.participant AS participant,
+                    cast ( taskrec.json #>> '{test, spec}' AS json ) AS test
+                ) t
+        );
+
+    ELSE
+
+        -- Anything still waiting to be merged is out of date.
+        DELETE FROM run_deferred
+        WHERE run = NEW.id AND method = 'merged-results';
+
+        INSERT INTO run_deferred (run, method, tool, input)
+        VALUES (
+            NEW.id,
+            'merged-results',
+            taskrec.tool_name,
+            row_to_json(t) FROM (
+                SELECT
+                    taskrec.json -> 'test' AS test,
+                    NEW.result_full AS results
+                ) t
+        );
+
+    END IF;
+
+    NOTIFY run_deferred;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER run_deferred_run_after AFTER INSERT OR UPDATE ON run
+       FOR EACH ROW EXECUTE PROCEDURE run_deferred_run_after();
+
+
+
+-- Claim a batch of work.  Rows stay locked for the duration of the
+-- transaction so other workers skip them, and should be disposed of
+-- with run_deferred_complete() before committing.
+
+CREATE OR REPLACE FUNCTION run_deferred_claim(
+    max_items INTEGER
+)
+RETURNS TABLE (
+    id BIGINT,
+    method TEXT,
+    tool TEXT,
+    input JSONB
+)
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        run_deferred.id,
+        run_deferred.method,
+        run_deferred.tool,
+        run_deferred.input
+    FROM run_deferred
+    ORDER BY run_deferred.added, run_deferred.id
+    LIMIT max_items
+    FOR UPDATE SKIP LOCKED;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Put the outcome of a tool method invocation into its run and
+-- remove the work from the queue.  Output that isn't valid JSON is
+-- treated as a failure of the method.
+
+CREATE OR REPLACE FUNCTION run_deferred_complete(
+    item_id BIGINT,
+    status INTEGER,    -- Exit status of the method
+    output TEXT        -- Standard output if successful, error if not
+)
+RETURNS VOID
+AS $$
+DECLARE
+    item RECORD;
+    parsed JSONB;
+    failure TEXT;
+BEGIN
+
+    DELETE FROM run_deferred WHERE id = item_id RETURNING * INTO item;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    IF status = 0 THEN
+        parsed := text_to_jsonb(regexp_replace(output, '\s+$', ''), FALSE);
+        IF parsed IS NULL THEN
+            failure := 'Tool returned invalid JSON: ' || COALESCE(output, '');
+        END IF;
+    ELSE
+        failure := COALESCE(output, 'No error given');
+    END IF;
+
+    IF item.method = 'participant-data' THEN
+
+        IF failure IS NULL THEN
+            UPDATE run
+            SET part_data = parsed
+            WHERE id = item.run;
+        ELSE
+            -- Runs that haven't started can't without this.
+            UPDATE run
+            SET
+                state = CASE WHEN state = run_state_pending()
+                             THEN run_state_nonstart()
+                             ELSE state END,
+                errors = 'Unable to get participant data: ' || failure
+            WHERE id = item.run;
+        END IF;
+
+    ELSIF item.method = 'merged-results' THEN
+
+        IF failure IS NULL THEN
+            UPDATE run
+            SET result_merged = parsed
+            WHERE id = item.run;
+        ELSE
+            -- TODO: This leaves the result empty.  Maybe post some sort of failure?
+            UPDATE run
+            SET errors = 'Unable to get merged result: ' || failure
+            WHERE id = item.run;
+        END IF;
+
+    ELSE
+        -- The item is gone, so there's no sense in raising an
+        -- exception and taking the rest of the batch with it.
+        RAISE WARNING 'Unsupported method %', item.method;
+    END IF;
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Determine whether a run has participant data coming
+
+CREATE OR REPLACE FUNCTION run_part_data_pending(
+    run_id BIGINT
+)
+RETURNS BOOLEAN
+AS $$
+BEGIN
+    RETURN EXISTS (SELECT * FROM run_deferred
+                   WHERE run = run_id AND method = 'participant-data');
+END;
+$$ LANGUAGE plpgsql;
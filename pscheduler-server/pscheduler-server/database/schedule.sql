@@ -66,106 +66,75 @@ AS
 
 -- What tasks need a run scheduled and when.  This explicitly excludes
 -- background tasks, which are handled separately.
+--
+-- Candidates come from schedule_due, which holds the earliest time
+-- each task could run without regard to the current time.  Anything
+-- due in the past has its time adjusted to now or the next repetition
+-- after it.
 
 DROP VIEW IF EXISTS schedule_runs_to_schedule;
 CREATE OR REPLACE VIEW schedule_runs_to_schedule
 AS
+    WITH candidates AS (
 
-    -- TODO: Need to go through this and make sure the subqueries
-    -- aren't selecting columns that aren't used.
-
-    WITH interim AS (
+        -- Anything due within the horizon
+        SELECT schedule_due.*
+        FROM
+            schedule_due,
+            configurables
+        WHERE
+            due < (normalized_now() + schedule_horizon)
 
-        -- Non-repeating tasks with no runs scheduled
+        UNION
 
-        SELECT
-            task.id AS task,
-	    task.uuid,
-            task.enabled,
-            task.added,
-            task.duration,
-            task.slip,
-            task.max_runs,
-            task.runs,
-            task.until,
-            greatest(normalized_now(), task.start) AS trynext,
-	    task.participant,
-            test.scheduling_class,
-	    task.json
+        -- Backgrounders, which aren't bound by the horizon
+        SELECT schedule_due.*
         FROM
-            task
+            schedule_due
+            JOIN task ON task.id = schedule_due.task
             JOIN test ON test.id = task.test
         WHERE
-	    repeat IS NULL
-	    AND NOT EXISTS (SELECT * FROM run WHERE run.task = task.id)
+            test.scheduling_class = scheduling_class_background_multi()
 
-        UNION ALL
-
-        -- Repeating tasks without runs
+    ),
+    interim AS (
 
         SELECT
             task.id AS task,
             task.uuid,
-            task.enabled,
             task.added,
             task.duration,
             task.slip,
-            task.max_runs,
             task.runs,
             task.until,
-            greatest(task.start, normalized_now()) AS trynext,
-            task.participant,
+            CASE
+                WHEN candidates.due > normalized_now()
+                    THEN candidates.due
+                WHEN task.repeat IS NULL OR task.runs = 0
+                    THEN normalized_now()
+                ELSE task_next_run(task.first_start, normalized_now(),
+                                   task.repeat)
+            END AS trynext,
             test.scheduling_class,
-	    task.json
+            task.json,
+            task.participants
         FROM
-            task
-            JOIN test on test.id = task.test
-        WHERE
-	    repeat IS NOT NULL
-            AND (until IS NULL OR until > normalized_now())
-	    AND runs = 0
-
-	UNION ALL
-
-        -- Repeating tasks with runs
-        SELECT
-            task.id AS task,
-            task.uuid,
-            task.enabled,
-            task.added,
-            duration,
-            task.slip,
-            task.max_runs,
-            task.runs,
-            task.until,
-            task_next_run(task.first_start,
-                         greatest(normalized_now(), task.start, run_latest.latest),
-                         repeat) AS trynext,
-            task.participant,
-            (SELECT scheduling_class FROM test WHERE test.id = task.test) AS scheduling_class,
-	    task.json
-       FROM
-            task
-            JOIN run_latest ON run_latest.task = task.id
-        WHERE
-            task.repeat IS NOT NULL
-            AND task.runs > 0
-            AND EXISTS (SELECT * FROM run WHERE run.task = task.id)
+            candidates
+            JOIN task ON task.id = candidates.task
+            JOIN test ON test.id = task.test
     )
     SELECT
         task,
 	uuid,
 	runs,
         trynext,
-	json
+	json,
+        participants
     FROM
-        interim, 
+        interim,
         configurables
     WHERE
-        enabled
-	AND participant = 0
-        AND ( (max_runs IS NULL) OR (runs < max_runs) )
-        AND ( (until IS NULL) OR (trynext < until) )
+        ( (until IS NULL) OR (trynext < until) )
 	-- Anything that fits the scheduling horizon or is a backgrounder
         AND (
             trynext + duration + slip < (normalized_now() + schedule_horizon)
@@ -286,8 +255,6 @@ DECLARE
     horizon_end TIMESTAMP WITH TIME ZONE;
     taskrec RECORD;
     time_range TSTZRANGE;
-    last_end TIMESTAMP WITH TIME ZONE;
-    run_record RECORD;
 BEGIN
 
     -- Validate the input
@@ -348,13 +315,11 @@ BEGIN
 
     time_range := tstzrange(range_start, range_end, '[)');
 
-    last_end := range_start;
-
 
-    -- Sift through everything on the timeline that overlaps with the
-    -- time range and find the gaps.  Other than non-starters, the
-    -- runs we care about avoiding are represented by this truth
-    -- table:
+    -- Find the gaps between everything on the timeline that overlaps
+    -- with the time range.  Other than non-starters, which aren't in
+    -- run_busy, the runs we care about avoiding are represented by
+    -- this truth table:
     --
     -- Proposed  ||         Run on Timeline         |
     -- Run       || Background | Normal | Exclusive |
@@ -362,59 +327,45 @@ BEGIN
     -- Background|| Ignore     | Ignore |   Ignore  |
     -- Normal    || Ignore     | Ignore |   Avoid   |
     -- Exclusive || Ignore     | Avoid  |   Avoid   |
+    --
+    -- Background runs aren't in run_busy, either.
+    --
+    -- Each gap runs from the latest end of anything before it (or
+    -- the start of the range) to the start of the next busy time (or
+    -- the end of the range), and must be at least as long as the task
+    -- for it to be one that can be proposed.
 
-    FOR run_record IN
-        SELECT run.*
-        FROM
-            run
-            JOIN task ON task.id = run.task
-            JOIN test ON test.id = task.test
-            JOIN scheduling_class
-                 ON scheduling_class.id = test.scheduling_class
+    RETURN QUERY
+    WITH busy AS (
+        SELECT
+            lower(run_busy.times) AS busy_lower,
+            -- Clamp the end time to the horizon
+            least(upper(run_busy.times), horizon_end) AS busy_upper
+        FROM run_busy
         WHERE
-            -- Overlap
-	    times && time_range
-            -- Ignore non-starters
-            AND state <> run_state_nonstart()
-            -- Ignore background
-            AND NOT scheduling_class.anytime
-            AND (
-                -- Always avoid exclusive runs
-                (scheduling_class.exclusive)
-                -- Avoid normal runs if the proposed run is exclusive
-                OR (taskrec.exclusive AND NOT scheduling_class.exclusive)
-            )
-        ORDER BY times
-    LOOP
-
-        -- Clamp the end time to the horizon
-        IF upper(run_record.times) > horizon_end
-        THEN
-            run_record.times = tstzrange( lower(run_record.times), horizon_end,
-                '[)' );
-        END IF;
-
-        -- A run that starts beyond the last end implies a gap, but
-        -- the gap must be longer than the duration of the task for it
-        -- to one that can be proposed.
-        IF lower(run_record.times) > last_end
-           AND lower(run_record.times) - last_end >= taskrec.duration
-        THEN
-            RETURN QUERY
-                SELECT last_end AS lower, lower(run_record.times) AS upper;
-        END IF;
-
-        last_end := upper(run_record.times);
-
-    END LOOP;
-
-    -- If the end of the last run is before the end of the range,
-    -- that's also a gap.
-    IF last_end < range_end
-       AND range_end - last_end >= taskrec.duration
-    THEN
-        RETURN QUERY SELECT last_end, range_end;
-    END IF;
+            run_busy.times && time_range
+            AND (run_busy.exclusive OR taskrec.exclusive)
+    ),
+    gaps AS (
+        SELECT
+            greatest(range_start,
+                     max(busy_upper) OVER (
+                         ORDER BY busy_lower, busy_upper
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+                     ) AS gap_lower,
+            busy_lower AS gap_upper
+        FROM busy
+        UNION ALL
+        SELECT
+            greatest(range_start, (SELECT max(busy_upper) FROM busy)),
+            range_end
+    )
+    SELECT gap_lower, gap_upper
+    FROM gaps
+    WHERE
+        gap_upper > gap_lower
+        AND gap_upper - gap_lower >= taskrec.duration
+    ORDER BY gap_lower;
 
     RETURN;
 
@@ -427,11 +378,15 @@ $$ LANGUAGE plpgsql;
 -- Maintenance
 --
 
+-- TODO: Can remove this after GA release.
+DROP FUNCTION IF EXISTS schedule_maint_minute();
+
 CREATE OR REPLACE FUNCTION schedule_maint_minute()
-RETURNS VOID
+RETURNS INTEGER
 AS $$
 DECLARE
     older_than TIMESTAMP WITH TIME ZONE;
+    removed INTEGER;
 BEGIN
 
     SELECT INTO older_than normalized_now() - keep_runs_tasks
@@ -453,6 +408,9 @@ BEGIN
             OR repeat IS NULL
             )
     ;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+
+    RETURN removed;
 
 END;
 $$ LANGUAGE plpgsql;
@@ -0,0 +1,192 @@
+--
+-- When Tasks are Next Due to be Scheduled
+--
+
+-- This table holds the earliest time each task could next have a run
+-- scheduled without regard to the current time, which allows the
+-- scheduler to find work without evaluating every task in the
+-- system.  Tasks that will never need another run scheduled (disabled,
+-- not led by this system or finished) have no row.
+--
+-- It is kept current by triggers on the task and run tables.
+
+DO $$
+DECLARE
+    t_name TEXT;            -- Name of the table being worked on
+    t_version INTEGER;      -- Current version of the table
+    t_version_old INTEGER;  -- Version of the table at the start
+BEGIN
+
+    --
+    -- Preparation
+    --
+
+    t_name := 'schedule_due';
+
+    t_version := table_version_find(t_name);
+    t_version_old := t_version;
+
+
+    --
+    -- Upgrade Blocks
+    --
+
+    -- Version 0 (nonexistant) to version 1
+    IF t_version = 0
+    THEN
+
+        CREATE TABLE schedule_due (
+
+        	-- Task due to be scheduled
+        	task		BIGINT
+        			PRIMARY KEY
+        			REFERENCES task(id)
+        			ON DELETE CASCADE,
+
+        	-- Earliest time the next run could start.  Minus
+        	-- infinity means as soon as possible.
+        	due		TIMESTAMP WITH TIME ZONE
+        			NOT NULL
+        );
+
+        CREATE INDEX schedule_due_due ON schedule_due(due);
+
+	t_version := t_version + 1;
+
+    END IF;
+
+
+    --
+    -- Cleanup
+    --
+
+    PERFORM table_version_set(t_name, t_version, t_version_old);
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+
+-- Recalculate when a task is due
+
+CREATE OR REPLACE FUNCTION schedule_due_update(
+    task_id BIGINT
+)
+RETURNS VOID
+AS $$
+DECLARE
+    taskrec RECORD;
+    new_due TIMESTAMP WITH TIME ZONE;
+BEGIN
+
+    SELECT INTO taskrec
+        task.*,
+        run_latest.latest
+    FROM
+        task
+        LEFT JOIN run_latest ON run_latest.task = task.id
+    WHERE
+        task.id = task_id;
+
+    IF NOT FOUND
+       OR NOT taskrec.enabled
+       OR taskrec.participant <> 0
+       OR ( (taskrec.max_runs IS NOT NULL)
+            AND (taskrec.runs >= taskrec.max_runs) )
+    THEN
+        DELETE FROM schedule_due WHERE task = task_id;
+        RETURN;
+    END IF;
+
+    IF taskrec.repeat IS NULL THEN
+
+        -- Non-repeating tasks are due until they have a run.
+        IF EXISTS (SELECT * FROM run WHERE run.task = task_id) THEN
+            new_due := NULL;
+        ELSE
+            new_due := COALESCE(taskrec.start, '-infinity');
+        END IF;
+
+    ELSIF taskrec.runs = 0 THEN
+
+        new_due := COALESCE(taskrec.start, '-infinity');
+
+    ELSIF taskrec.latest IS NOT NULL THEN
+
+        new_due := task_next_run(taskrec.first_start,
+            greatest(taskrec.start, taskrec.latest), taskrec.repeat);
+
+    ELSE
+
+        -- Repeaters that have had runs but don't have any now are
+        -- left alone.
+        new_due := NULL;
+
+    END IF;
+
+    IF new_due IS NULL
+       OR ( (taskrec.until IS NOT NULL) AND (new_due >= taskrec.until) )
+    THEN
+        DELETE FROM schedule_due WHERE task = task_id;
+        RETURN;
+    END IF;
+
+    INSERT INTO schedule_due (task, due)
+    VALUES (task_id, new_due)
+    ON CONFLICT (task) DO UPDATE
+    SET due = EXCLUDED.due;
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+DROP TRIGGER IF EXISTS schedule_due_task_change ON task CASCADE;
+
+CREATE OR REPLACE FUNCTION schedule_due_task_change()
+RETURNS TRIGGER
+AS $$
+BEGIN
+    PERFORM schedule_due_update(NEW.id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER schedule_due_task_change AFTER INSERT OR UPDATE ON task
+    FOR EACH ROW EXECUTE PROCEDURE schedule_due_task_change();
+
+
+
+-- Note that this has to fire after run_latest_update, which it does
+-- because triggers go in alphabetical order.
+
+DROP TRIGGER IF EXISTS schedule_due_run_change ON run CASCADE;
+
+CREATE OR REPLACE FUNCTION schedule_due_run_change()
+RETURNS TRIGGER
+AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM schedule_due_update(OLD.task);
+        RETURN OLD;
+    END IF;
+    PERFORM schedule_due_update(NEW.task);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER schedule_due_run_change AFTER INSERT OR UPDATE OF times OR DELETE ON run
+    FOR EACH ROW EXECUTE PROCEDURE schedule_due_run_change();
+
+
+
+-- Fill in anything that was around before this table existed.
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT * FROM schedule_due) THEN
+        PERFORM schedule_due_update(id) FROM task;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
@@ -577,11 +577,17 @@ $$ LANGUAGE plpgsql;
 --- Maintenance
 ---
 
+-- Remove old tasks, returning the number removed.
+
+-- TODO: Can remove this after GA release.
+DROP FUNCTION IF EXISTS task_purge();
+
 CREATE OR REPLACE FUNCTION task_purge()
-RETURNS VOID
+RETURNS INTEGER
 AS $$
 DECLARE
     older_than TIMESTAMP WITH TIME ZONE;
+    purged INTEGER;
 BEGIN
 
     SELECT INTO older_than normalized_now() - keep_runs_tasks
@@ -604,6 +610,9 @@ BEGIN
             OR until < older_than
             )
     ;
+    GET DIAGNOSTICS purged = ROW_COUNT;
+
+    RETURN purged;
 
 END;
 $$ LANGUAGE plpgsql;
@@ -3,6 +3,227 @@
 --
 
 
+-- Maintenance jobs run by the ticker daemon.  Each job is a function
+-- returning the number of rows it affected and runs on its own cadence
+-- in its own short transaction.  Jobs with a chunk size are given it
+-- as their only argument and called repeatedly until they do less than
+-- a full chunk of work or use up their time budget, whichever comes
+-- first.  This keeps a long purge from holding up anything
+-- time-critical.
+
+DO $$
+DECLARE
+    t_name TEXT;            -- Name of the table being worked on
+    t_version INTEGER;      -- Current version of the table
+    t_version_old INTEGER;  -- Version of the table at the start
+BEGIN
+
+    --
+    -- Preparation
+    --
+
+    t_name := 'ticker_job';
+
+    t_version := table_version_find(t_name);
+    t_version_old := t_version;
+
+
+    --
+    -- Upgrade Blocks
+    --
+
+    -- Version 0 (nonexistant) to version 1
+    IF t_version = 0
+    THEN
+
+        CREATE TABLE ticker_job (
+
+            -- Name of the job
+            name            TEXT
+                            PRIMARY KEY,
+
+            -- Function to call
+            function        TEXT
+                            NOT NULL,
+
+            -- How often to run it
+            cadence         INTERVAL
+                            NOT NULL
+                            CHECK (cadence > 'PT0S'),
+
+            -- Most rows to ask the function to work on at once, NULL
+            -- if it doesn't take a chunk size
+            chunk           INTEGER
+                            CHECK (chunk IS NULL OR chunk > 0),
+
+            -- Longest to keep calling a chunked function
+            budget          INTERVAL
+                            DEFAULT 'PT5S',
+
+            -- When the job should run next
+            next_run        TIMESTAMP WITH TIME ZONE
+                            DEFAULT now(),
+
+            -- When it last ran, how long it took, how many rows it
+            -- affected and any error it raised
+            last_run        TIMESTAMP WITH TIME ZONE,
+            last_duration   INTERVAL,
+            last_rows       BIGINT,
+            last_error      TEXT,
+
+            -- Totals since the job was added
+            runs            BIGINT
+                            DEFAULT 0,
+            failures        BIGINT
+                            DEFAULT 0,
+            total_rows      BIGINT
+                            DEFAULT 0
+        );
+
+        CREATE INDEX ticker_job_next_run ON ticker_job(next_run);
+
+        t_version := t_version + 1;
+
+    END IF;
+
+
+    --
+    -- Cleanup
+    --
+
+    PERFORM table_version_set(t_name, t_version, t_version_old);
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- The jobs.  Their definitions are refreshed on every build but their
+-- schedules and histories are left alone.
+
+INSERT INTO ticker_job (name, function, cadence, chunk, budget)
+VALUES
+    ('run-stragglers',    'run_handle_stragglers',  'PT15S', NULL, NULL),
+    ('run-purge',         'run_purge',              'PT15S', 1000, 'PT5S'),
+    ('task-purge',        'task_purge',             'PT15S', NULL, NULL),
+    ('schedule-cleanup',  'schedule_maint_minute',  'PT1M',  NULL, NULL),
+    ('archiving-expire',  'archiving_maint_minute', 'PT1M',  NULL, NULL)
+ON CONFLICT (name) DO UPDATE
+SET
+    function = EXCLUDED.function,
+    cadence = EXCLUDED.cadence,
+    chunk = EXCLUDED.chunk,
+    budget = EXCLUDED.budget;
+
+
+
+-- Return the jobs that are due to run, most overdue first.
+
+CREATE OR REPLACE FUNCTION ticker_job_due()
+RETURNS TABLE (
+    name TEXT,
+    chunk INTEGER,
+    budget FLOAT
+)
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        ticker_job.name,
+        ticker_job.chunk,
+        extract('epoch' FROM coalesce(ticker_job.budget, 'PT0S'))::FLOAT
+    FROM ticker_job
+    WHERE ticker_job.next_run <= now()
+    ORDER BY ticker_job.next_run;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Do one pass of a job, returning the number of rows affected.
+
+CREATE OR REPLACE FUNCTION ticker_job_run(
+    job_name TEXT
+)
+RETURNS INTEGER
+AS $$
+DECLARE
+    job RECORD;
+    affected INTEGER;
+BEGIN
+
+    SELECT INTO job * FROM ticker_job WHERE name = job_name;
+    IF NOT FOUND
+    THEN
+        RAISE EXCEPTION 'No such job %', job_name;
+    END IF;
+
+    IF job.chunk IS NULL
+    THEN
+        EXECUTE format('SELECT %I()', job.function) INTO affected;
+    ELSE
+        EXECUTE format('SELECT %I($1)', job.function)
+            INTO affected USING job.chunk;
+    END IF;
+
+    RETURN coalesce(affected, 0);
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- Record how a job went and schedule its next run.  The duration is
+-- in seconds and the error is NULL if there wasn't one.
+
+CREATE OR REPLACE FUNCTION ticker_job_record(
+    job_name TEXT,
+    duration FLOAT,
+    affected BIGINT,
+    error TEXT DEFAULT NULL
+)
+RETURNS VOID
+AS $$
+DECLARE
+    started TIMESTAMP WITH TIME ZONE;
+BEGIN
+
+    started := now() - make_interval(secs := duration);
+
+    UPDATE ticker_job
+    SET
+        next_run = greatest(started + cadence, now()),
+        last_run = started,
+        last_duration = make_interval(secs := duration),
+        last_rows = affected,
+        last_error = error,
+        runs = runs + 1,
+        failures = failures + (CASE WHEN error IS NULL THEN 0 ELSE 1 END),
+        total_rows = total_rows + affected
+    WHERE name = job_name;
+
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- How long until the next job is due, or NULL if there are no jobs.
+
+CREATE OR REPLACE FUNCTION ticker_job_wait()
+RETURNS INTERVAL
+AS $$
+BEGIN
+    RETURN (SELECT greatest(min(next_run) - now(), 'PT0S'::INTERVAL)
+            FROM ticker_job);
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- What follows is the fixed-interval ticker the daemon used before
+-- jobs had their own cadences.  It's kept for manual use.
+
+
 -- Things that get done a fifteen-second intervals
 CREATE OR REPLACE FUNCTION ticker_fifteen()
 RETURNS VOID
@@ -406,6 +406,9 @@ $$ LANGUAGE plpgsql;
 
 -- Get a JSON array of the enumerations of all tools that can run a
 -- test, returned in order of highest to lowest preference.
+--
+-- The API server no longer uses this.  It does the same thing itself
+-- so the can-run checks can run in parallel and be cached.
 
 -- TODO: Remove this after release
 DROP FUNCTION IF EXISTS api_tools_for_test(JSONB);
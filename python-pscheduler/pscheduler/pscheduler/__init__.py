@@ -1,33 +1,180 @@
 #
 # Initialization for pScheduler Python Package
 #
+# The modules in this package pull in a lot of other packages (requests,
+# jsonschema, dnspython, psycopg2, netifaces and more) that take a good
+# while to import.  Most programs, plugin methods in particular, use
+# only a few functions, so rather than import everything up front, each
+# module is imported the first time something in it is used.  Anything
+# that was available as pscheduler.NAME when this file imported every
+# module with "from .module import *" still is.
+#
+
+import importlib
+import sys
+import threading
+import types
+
+
+# The modules and the names each provides, in the order they were
+# originally imported.  When adding something public to a module,
+# add it here, too.
+
+_MODULES = [
+    ("api", [
+        "api_has_bwctl", "api_has_pscheduler", "api_has_services",
+        "api_is_run", "api_is_task", "api_ping", "api_ping_all_up",
+        "api_ping_list", "api_replace_host", "api_result_delimiter",
+        "api_root", "api_this_host", "api_url"
+    ]),
+    ("clockstate", [
+        "STA_NANO", "STA_UNSYNC", "TimevalStruct", "TimexStruct",
+        "clock_state", "ntp_adjtime"
+    ]),
+    ("db", [ "PgConnection", "PgQueryResult", "pg_connection", "pg_cursor" ]),
+    ("durationrange", [ "DurationRange" ]),
+    ("exit", [ "set_graceful_exit" ]),
+    ("exitstatus", [ "fail", "fail_other", "succeed", "succeed_json" ]),
+    ("enummatcher", [ "EnumMatcher" ]),
+    ("failopt", [ "FailingOptionParser" ]),
+    ("fanout", [ "fan_out" ]),
+    ("filestring", [ "string_from_file" ]),
+    ("ipaddr", [ "ip_addr_version", "ip_normalize_version" ]),
+    ("iso8601", [
+        "datetime_as_iso8601", "iso8601_as_datetime",
+        "iso8601_as_timedelta", "timedelta_as_iso8601"
+    ]),
+    ("jsonval", [ "json_validate" ]),
+    ("log", [
+        "CRITICAL", "DEBUG", "ERROR", "INFO", "Log", "STATE_VARIABLE",
+        "WARNING", "auth", "authpriv", "cron", "daemon", "ftp", "kern",
+        "local0", "local1", "local2", "local3", "local4", "local5",
+        "local6", "local7", "lpr", "mail", "news", "syslog", "user", "uucp"
+    ]),
+    ("numericrange", [ "NumericRange" ]),
+    ("program", [ "run_program", "this" ]),
+    ("pidfile", [ "PidFile" ]),
+    ("pluginhost", [
+        "plugin_host_address", "plugin_host_address_parse",
+        "plugin_host_disable_variable", "plugin_host_invoke",
+        "plugin_host_slop", "plugin_host_user"
+    ]),
+    ("psas", [ "as_bulk_resolve" ]),
+    ("psdns", [
+        "dns_bulk_resolve", "dns_default_timeout", "dns_resolve",
+        "dns_resolve_reverse"
+    ]),
+    ("psjson", [
+        "json_check_schema", "json_decomment", "json_dump", "json_load",
+        "json_substitute"
+    ]),
+    ("pstime", [
+        "seconds_as_timedelta", "time_epoch", "time_now", "time_until",
+        "time_until_seconds", "timedelta_as_seconds", "timedelta_is_zero"
+    ]),
+    ("psurl", [
+        "URLException", "url_delete", "url_delete_list", "url_get",
+        "url_post", "url_put", "url_session_cache_clear",
+        "url_session_configure", "verify_keys_default"
+    ]),
+    ("retry", [ "RetryPolicy" ]),
+    ("saferun", [ "safe_run" ]),
+    ("sinumber", [
+        "number_as_si", "si_as_number", "si_multipliers", "si_range",
+        "si_regex"
+    ]),
+    ("stringmatcher", [ "StringMatcher" ]),
+    ("speccli", [ "speccli_build_args" ]),
+    ("text", [ "prefixed_wrap", "terminal_size" ]),
+    ("threadsafe", [ "ThreadSafeDictionary" ]),
+    ("interface", [
+        "LocalIPList", "address_interface", "interface_affinity",
+        "source_affinity", "source_interface"
+    ]),
+]
+
+_NAME_MODULE = dict([ (name, module)
+                      for (module, names) in _MODULES
+                      for name in names ])
+
+
+
+class _LazyPackage(types.ModuleType):
+
+    """
+    Stands in for this package in sys.modules and imports modules when
+    names they provide are first asked for.
+    """
+
+    def __init__(self, original):
+        super(_LazyPackage, self).__init__(original.__name__, original.__doc__)
+        self.__dict__.update(original.__dict__)
+        # Python 2 empties a module's globals when it goes away, and
+        # the functions in this file still need them.
+        self.__dict__["_original"] = original
+        self.__dict__["_load_lock"] = threading.RLock()
+        self.__dict__["_all_loaded"] = False
+        self.__dict__["__all__"] = sorted(_NAME_MODULE.keys())
+
+
+    def _load(self, module_name):
+        """
+        Import a module and make the names it provides available.
+        Anything already set on the package is left alone.
+        """
+        module = importlib.import_module("." + module_name, self.__name__)
+        with self._load_lock:
+            for name in dict(_MODULES)[module_name]:
+                if name not in self.__dict__:
+                    self.__dict__[name] = getattr(module, name)
+        return module
+
+
+    def _load_all(self):
+        """
+        Import every module the way this package used to, making
+        everything they provide available, including whatever they
+        imported themselves.
+        """
+        if self._all_loaded:
+            return
+        # As in _load(), the imports happen outside the lock so it's
+        # never held while waiting on the interpreter's import lock.
+        modules = [ importlib.import_module("." + module_name, self.__name__)
+                    for (module_name, names) in _MODULES ]
+        with self._load_lock:
+            for module in modules:
+                for name in [ name for name in dir(module)
+                              if not name.startswith("_") ]:
+                    if name not in self.__dict__:
+                        self.__dict__[name] = getattr(module, name)
+            self.__dict__["_all_loaded"] = True
+
+
+    def __getattr__(self, name):
+        # This is only called when normal lookup comes up empty.
+
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        if name in _NAME_MODULE:
+            self._load(_NAME_MODULE[name])
+        elif name in dict(_MODULES):
+            return importlib.import_module("." + name, self.__name__)
+        elif not self._all_loaded:
+            # Might be something a module imported and passed along.
+            self._load_all()
+
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute '%s'" % (
+                name))
+
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()) | set(_NAME_MODULE.keys()))
+
+
 
-from .api import *
-from .clockstate import *
-from .db import *
-from .durationrange import *
-from .exit import *
-from .exitstatus import *
-from .enummatcher import *
-from .failopt import *
-from .filestring import *
-from .ipaddr import *
-from .iso8601 import *
-from .jsonval import *
-from .log import *
-from .numericrange import *
-from .program import *
-from .pidfile import *
-from .psas import *
-from .psdns import *
-from .psjson import *
-from .pstime import *
-from .psurl import *
-from .retry import *
-from .saferun import *
-from .sinumber import *
-from .stringmatcher import *
-from .speccli import *
-from .text import *
-from .threadsafe import *
-from .interface import *
+sys.modules[__name__] = _LazyPackage(sys.modules[__name__])
@@ -162,11 +162,16 @@ class PgConnection:
 
     
 
-    def wait(self, timeout=None):
+    def wait(self, timeout=None, wake=[]):
         """
         Wait through 'timeout' (in seconds) for a notification, or forever
         if it is None.  Return True if a notification was received or
         False otherwise.
+
+        If 'wake' is provided, it is a list of additional file
+        descriptors or objects with a fileno() method.  Any of them
+        becoming readable ends the wait and counts as a notification.
+        Draining them is the caller's responsibility.
         """
 
         if timeout is not None:
@@ -174,7 +179,7 @@ class PgConnection:
 
         while True:
             try:
-                selected = select.select([self.pg],[],[], timeout)
+                selected = select.select([self.pg] + list(wake),[],[], timeout)
                 break
             except select.error as ex:
                 err_no, message = ex
@@ -187,9 +192,12 @@ class PgConnection:
         if selected == ([],[],[]):
             return False
 
+        woken = len([ item for item in selected[0]
+                      if item is not self.pg ]) > 0
+
         self.pg.poll()
         self.__capture_notifications()
-        return len(self.pending_notifications) > 0
+        return woken or len(self.pending_notifications) > 0
 
     def query(self, query, args=[]):
         cursor = self.pg.cursor()
@@ -0,0 +1,112 @@
+"""
+Functions for doing things to many items concurrently
+"""
+
+import multiprocessing.dummy
+import sys
+import threading
+
+# See Python 2.6 workaround below
+import weakref
+
+
+def fan_out(function,     # Function to call with each item
+            items,        # List of items
+            threads=10,   # Maximum concurrent calls
+            abort=None    # Function given each result, True to stop
+            ):
+    """
+    Call a function for each item in a list concurrently and return a
+    list of the results in the same order as the items.
+
+    If an abort function is provided, it will be called with each
+    result as it arrives.  Once it returns True, no further calls will
+    be started and the results of any that weren't will be None.
+    Calls already in progress are allowed to finish so that their
+    results, which may need to be cleaned up after, aren't lost.
+
+    If any call raises an exception, it is treated as an abort and
+    the exception is raised once the fan-out has stopped.  The results
+    of other calls are lost when that happens, so functions whose
+    results must be cleaned up after shouldn't raise exceptions.
+
+    WARNING: This function will create a pool of up to 'threads'
+    threads.
+    """
+
+    if len(items) == 0:
+        return []
+
+    if len(items) == 1 or threads == 1:
+        # Not worth the overhead.
+        results = []
+        for item in items:
+            result = function(item)
+            results.append(result)
+            if abort is not None and abort(result):
+                break
+        return results + [ None ] * (len(items) - len(results))
+
+    # Work around a bug in 2.6
+    # TODO: Get rid of this when 2.6 is no longer in the picture.
+    if not hasattr(threading.current_thread(), "_children"):
+        threading.current_thread()._children = weakref.WeakKeyDictionary()
+
+    stop = threading.Event()
+
+    def call_one(arg):
+        index, item = arg
+        if stop.is_set():
+            return (index, False, None)
+        try:
+            return (index, True, function(item))
+        except Exception:
+            stop.set()
+            return (index, False, sys.exc_info())
+
+    results = [ None ] * len(items)
+    failure = None
+
+    pool = multiprocessing.dummy.Pool(processes=min(len(items), threads))
+
+    for index, succeeded, result in pool.imap_unordered(
+            call_one,
+            list(enumerate(items)),
+            chunksize=1):
+
+        if not succeeded:
+            if result is not None and failure is None:
+                failure = result
+            continue
+
+        results[index] = result
+
+        if abort is not None and abort(result):
+            stop.set()
+
+    pool.close()
+    pool.join()
+
+    if failure is not None:
+        raise failure[0], failure[1], failure[2]
+
+    return results
+
+
+
+if __name__ == "__main__":
+
+    import time
+
+    def snooze(item):
+        time.sleep(item)
+        return item
+
+    start = time.time()
+    print fan_out(snooze, [ 0.5 ] * 10)
+    print "Ten half-second calls took %.2fs" % (time.time() - start)
+
+    start = time.time()
+    print fan_out(snooze, [ 0.1, 0.5, 0.5, 0.5, 0.5, 0.5 ], threads=2,
+                  abort=lambda r: r == 0.1)
+    print "Aborted after %.2fs" % (time.time() - start)
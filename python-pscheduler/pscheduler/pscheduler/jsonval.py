@@ -4,7 +4,11 @@ values dictionaries
 """
 
 import copy
+import hashlib
 import jsonschema
+import threading
+
+from json import dumps as _json_dumps
 
 # TODO: Consider adding tile/description and maybe "example" (not
 # officially supported) as a way to generate the JSON dictionary.
@@ -728,6 +732,102 @@ __default_schema__ = {
 
 
 
+#
+# Compiled Validators
+#
+# Building a validator means putting the skeleton together with the
+# type dictionary and checking the result against the meta-schema,
+# which costs far more than most validations.  Validators are built
+# once for each distinct skeleton and kept.  The schema for each is
+# checked only when first seen.  Validators aren't safe to share
+# between threads because their reference resolvers keep state, so
+# each thread has its own.  Skeletons are almost always fixed in the
+# code, but to keep any that aren't from piling up, the caches are
+# emptied if they grow past a limit.
+#
+
+_CACHE_SIZE = 500
+
+_SKELETON_ELEMENTS = [ 'type', 'items', 'properties', 'additionalProperties',
+                       'required', 'local' ]
+
+_checked = set()             # Keys of skeletons whose schemas passed
+_checked_lock = threading.Lock()
+
+_validators = threading.local()
+
+
+
+def _skeleton_key(skeleton):
+    """
+    Produce a key that's the same for any two skeletons that would
+    produce the same schema, or None if the skeleton can't be
+    serialized.
+    """
+    try:
+        text = _json_dumps(
+            dict([ (element, skeleton[element])
+                   for element in _SKELETON_ELEMENTS
+                   if element in skeleton ]),
+            sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(text).hexdigest()
+
+
+
+def _validator_for(skeleton):
+    """
+    Get a validator for a skeleton, building it if there isn't one
+    already.
+    """
+
+    key = _skeleton_key(skeleton)
+
+    try:
+        cache = _validators.cache
+    except AttributeError:
+        cache = _validators.cache = {}
+
+    if key is not None and key in cache:
+        return cache[key]
+
+    # Build up the schema from the dictionaries and user input.
+
+    # A shallow copy is sufficient for this since we don't clobber the
+    # innards.
+    schema = copy.copy(__default_schema__)
+
+    for element in _SKELETON_ELEMENTS:
+        if element in skeleton:
+            schema[element] = skeleton[element]
+
+    # Let this throw whatever it's going to throw, since schema errors
+    # are problems wih the software, not the data.
+
+    # TODO: This doesn't seem to validate references.
+    with _checked_lock:
+        checked = key in _checked
+    if not checked:
+        jsonschema.Draft4Validator.check_schema(schema)
+        if key is not None:
+            with _checked_lock:
+                if len(_checked) >= _CACHE_SIZE:
+                    _checked.clear()
+                _checked.add(key)
+
+    validator = jsonschema.Draft4Validator(
+        schema, format_checker=jsonschema.FormatChecker())
+
+    if key is not None:
+        if len(cache) >= _CACHE_SIZE:
+            cache.clear()
+        cache[key] = validator
+
+    return validator
+
+
+
 def json_validate(json, skeleton):
     """
     Validate JSON against a jsonschema schema.
@@ -766,27 +866,10 @@ def json_validate(json, skeleton):
         raise ValueError("Skeleton provided must be a dictionary.")
 
 
-    # Build up the schema from the dictionaries and user input.
-
-    # A shallow copy is sufficient for this since we don't clobber the
-    # innards.
-    schema = copy.copy(__default_schema__)
-
-    for element in [ 'type', 'items', 'properties', 'additionalProperties',
-                     'required', 'local' ]:
-        if element in skeleton:
-            schema[element] = skeleton[element]
-
-    # Let this throw whatever it's going to throw, since schema errors
-    # are problems wih the software, not the data.
-
-    # TODO: This doesn't seem to validate references.
-    jsonschema.Draft4Validator.check_schema(schema)
-
+    validator = _validator_for(skeleton)
 
     try:
-        jsonschema.validate(json, schema,
-                            format_checker=jsonschema.FormatChecker())
+        validator.validate(json)
     except jsonschema.exceptions.ValidationError as ex:
         return (False, "At %s: %s" % (
             '/' + ('/'.join([str(x) for x in ex.absolute_path])),
@@ -0,0 +1,145 @@
+"""
+Functions for invoking plugin methods through the resident plugin host
+"""
+
+import os
+import pwd
+import socket
+import struct
+
+from psjson import *
+
+
+# Where the plugin host listens.  This is a Linux abstract-namespace
+# socket, which needs no directory and goes away with the process.
+plugin_host_address = "\0pscheduler-plugin-host"
+
+# Environment variable that turns use of the plugin host off.  The
+# host also sets this in the processes it runs so methods that invoke
+# other methods don't wait on themselves for a free slot.
+plugin_host_disable_variable = "PSCHEDULER_NO_PLUGIN_HOST"
+
+# Extra time allowed beyond a method's own timeout for the host to
+# answer before giving up on it.
+plugin_host_slop = 5
+
+# Account the host runs as.  Anyone can bind an abstract-namespace
+# socket, so the host is only trusted if it runs as this user, root
+# or whoever is calling.
+plugin_host_user = "pscheduler"
+
+# Linux-specific
+_SO_PEERCRED = getattr(socket, "SO_PEERCRED", 17)
+_PEERCRED_FORMAT = "3i"
+
+_trusted_uids = None
+
+
+def _plugin_host_trusted(sock):
+    """
+    Determine whether the process at the other end of a connected
+    socket may be trusted to run methods.
+    """
+    global _trusted_uids
+    if _trusted_uids is None:
+        trusted = set([ 0, os.getuid() ])
+        try:
+            trusted.add(pwd.getpwnam(plugin_host_user).pw_uid)
+        except KeyError:
+            pass
+        _trusted_uids = trusted
+
+    creds = sock.getsockopt(socket.SOL_SOCKET, _SO_PEERCRED,
+                            struct.calcsize(_PEERCRED_FORMAT))
+    _, uid, _ = struct.unpack(_PEERCRED_FORMAT, creds)
+    return uid in _trusted_uids
+
+
+def plugin_host_address_parse(address):
+    """
+    Convert a socket address as it would be given on the command line
+    into one usable with socket functions.  Abstract-namespace
+    addresses are written with a leading '@'.
+    """
+    if address.startswith("@"):
+        return "\0" + address[1:]
+    return address
+
+
+def plugin_host_invoke(argv,              # Class, name, method and args
+                       stdin=None,        # What to send to stdin
+                       timeout=None,      # Seconds
+                       timeout_ok=False,  # Treat timeouts as not being an error
+                       env_add=None,      # Add hash to method's environment
+                       address=plugin_host_address
+                       ):
+    """
+    Invoke a plugin method through the plugin host.
+
+    The arguments are the same as those after 'pscheduler internal
+    invoke' and the method sees the same standard input it would
+    have if run as a separate program.
+
+    Returns a tuple of (status, stdout, stderr) like run_program() or
+    None if the host isn't running or declined to handle the method,
+    in which case the caller should run it the old-fashioned way.
+    """
+
+    if os.environ.get(plugin_host_disable_variable):
+        return None
+
+    request = {
+        "argv": argv,
+        "stdin": stdin,
+        "timeout": timeout,
+        "timeout-ok": timeout_ok,
+        "env-add": env_add or {}
+    }
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.settimeout(None if timeout is None
+                        else timeout + plugin_host_slop)
+        try:
+            sock.connect(address)
+            if not _plugin_host_trusted(sock):
+                return None
+            # The host won't start anything until it has the whole
+            # request, so anything going wrong here is safe to treat
+            # like a refusal.
+            sock.sendall(json_dump(request) + "\n")
+            sock.shutdown(socket.SHUT_WR)
+        except socket.error:
+            # Not running, not reachable or refused us.
+            return None
+
+        received = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            received.append(data)
+
+    except socket.error:
+        # Anything that goes wrong after the host has accepted the
+        # request could mean the method ran.  Report it as a failure
+        # rather than running it a second time.
+        return (2, '', "Lost contact with the plugin host.")
+
+    finally:
+        sock.close()
+
+    try:
+        response = json_load("".join(received), strip=False)
+    except ValueError as ex:
+        return (2, '', "Invalid response from plugin host: %s" % (str(ex)))
+
+    if response.get("fallback", False):
+        return None
+
+    # Hand back byte strings, which is what running the program would
+    # have produced.
+    return (response["status"],
+            response["stdout"].encode("utf-8"),
+            response["stderr"].encode("utf-8"))
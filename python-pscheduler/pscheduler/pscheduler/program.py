@@ -198,6 +198,25 @@ def run_program(argv,              # Program name and args
         raise Exception("Can't run with null arguments.")
 
 
+    # Plugin method invocations go to the resident plugin host if it's
+    # available.  Line-at-a-time output and replacement environments
+    # aren't something it does, so those always get run here.
+
+    if argv[0:3] == [ "pscheduler", "internal", "invoke" ] \
+       and line_call is None and env is None:
+
+        hosted = pscheduler.plugin_host_invoke(argv[3:],
+                                               stdin=stdin,
+                                               timeout=timeout,
+                                               timeout_ok=timeout_ok,
+                                               env_add=env_add)
+        if hosted is not None:
+            status, stdout, stderr = hosted
+            if fail_message is not None and status != 0:
+                pscheduler.fail("%s: %s" % (fail_message, stderr))
+            return status, stdout, stderr
+
+
     # Build up a new, incorruptable copy of the environment for the
     # child process to use.
 
@@ -6,6 +6,13 @@ from json import load, loads, dump, dumps
 import sys
 import pscheduler
 
+# Use a faster parser for JSON that doesn't need comments stripped if
+# one is installed.
+try:
+    import ujson as _fast_json
+except ImportError:
+    _fast_json = None
+
 
 def json_decomment(json, prefix='#', null=False):
     """
@@ -62,6 +69,39 @@ def json_substitute(json, value, replacement):
 
 
 
+def _decomment_pairs(pairs):
+    """
+    INTERNAL USE ONLY: Build a dictionary from an object's pairs as
+    they're parsed, leaving out any whose names begin with '#'.  This
+    does what json_decomment() does without rebuilding the document
+    afterward.
+    """
+    return dict([ (name, value) for (name, value) in pairs
+                  if not name.startswith('#') ])
+
+
+
+def _json_loads(text, strip):
+    """
+    INTERNAL USE ONLY: Parse a string of JSON, stripping comments if
+    asked.
+    """
+    if strip:
+        return loads(text, object_pairs_hook=_decomment_pairs)
+
+    if _fast_json is not None:
+        try:
+            return _fast_json.loads(text, precise_float=True)
+        except ValueError:
+            # The fast parser balks at some valid JSON (e.g., integers
+            # too big for 64 bits).  Let the standard one have a go and
+            # produce the error message if it really is invalid.
+            pass
+
+    return loads(text)
+
+
+
 def json_check_schema(json, max_schema=None):
     """
     Check that the 'schema' value for a blob of JSON is no more than
@@ -102,7 +142,9 @@ def json_load(source=None, exit_on_error=False, strip=True, max_schema=None):
 
     strip - Remove all pairs whose names begin with '#'.  This is a
     low-budget way to support comments wthout requiring a parser that
-    understands them.  (Default True)
+    understands them.  Turning this off for trusted internal payloads
+    saves the work and allows use of a faster parser if one is
+    installed.  (Default True)
 
     max_schema - Check for a "schema" of no more than this integer value.
     """
@@ -111,9 +153,9 @@ def json_load(source=None, exit_on_error=False, strip=True, max_schema=None):
 
     try:
         if type(source) is str or type(source) is unicode:
-            json_in = loads(str(source))
+            json_in = _json_loads(str(source), strip)
         elif type(source) is file:
-            json_in = load(source)
+            json_in = _json_loads(source.read(), strip)
         else:
             raise Exception("Internal error: bad source type ", type(source))
     except ValueError as ex:
@@ -126,7 +168,7 @@ def json_load(source=None, exit_on_error=False, strip=True, max_schema=None):
     if max_schema is not None:
         json_check_schema(json_in, max_schema)
 
-    return json_decomment(json_in) if strip else json_in
+    return json_in
 
 
 
@@ -4,8 +4,13 @@ Functions for interacting with HTTP servers
 
 from psjson import *
 
+import contextlib
+import cookielib
 import httplib
+import os
 import requests
+import threading
+import time
 import urlparse
 
 from requests.packages.urllib3.poolmanager import PoolManager
@@ -42,22 +47,175 @@ class _SourceAddressAdapter(requests.adapters.HTTPAdapter):
 
         super(_SourceAddressAdapter, self).__init__(**kwargs)
 
-    def init_poolmanager(self, connections, maxsize, block=False):
+    def init_poolmanager(self, connections, maxsize, block=False,
+                         **pool_kwargs):
         self.poolmanager = PoolManager(num_pools=connections,
                                        maxsize=maxsize,
                                        block=block,
-                                       source_address=self.source_address)
+                                       source_address=self.source_address,
+                                       **pool_kwargs)
+
+
+
+#
+# Session Cache
+#
+# Sessions, and the pools of kept-alive connections inside them, are
+# held for re-use by everything in the process that talks to the same
+# place.  This saves setting up a new TCP connection and doing a TLS
+# handshake for every request.  Because they're shared by unrelated
+# callers, they don't keep cookies.
+#
+
+# Maximum number of connections kept alive for each destination
+_session_pool_size = 10
+
+# Seconds a session can go unused before it's closed
+_session_idle_timeout = 60
+
+
+class _SessionCache(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # [ session, last used, users ] keyed by (scheme, host, port, bind)
+        self.sessions = {}
+        self.pid = os.getpid()
+        self.next_sweep = 0
+
+    def __key(self, url, bind):
+        parsed = urlparse.urlparse(url)
+        port = parsed.port
+        if port is None:
+            port = 443 if parsed.scheme == "https" else 80
+        return (parsed.scheme, parsed.hostname, port, bind)
+
+    def __new_session(self, scheme, bind):
+        session = requests.Session()
+        session.cookies.set_policy(
+            cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        if bind is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=_session_pool_size)
+        else:
+            adapter = _SourceAddressAdapter(
+                (bind, 0),
+                pool_connections=1, pool_maxsize=_session_pool_size)
+        session.mount("%s://" % (scheme), adapter)
+        return session
+
+    def __sweep(self, now):
+        """
+        INTERNAL USE ONLY: Close sessions that have gone idle.  Must
+        be called with the lock held.
+        """
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + _session_idle_timeout
+        for key, (session, last_used, users) in list(self.sessions.items()):
+            if users == 0 and now - last_used > _session_idle_timeout:
+                del self.sessions[key]
+                session.close()
+
+    def __checkout(self, key, bind):
+        """
+        INTERNAL USE ONLY: Get a session and count it as being in use.
+        """
+        now = time.time()
+
+        with self.lock:
+
+            # Connections can't be shared with a parent process.
+            # Forget (but don't close) anything inherited from one.
+            if os.getpid() != self.pid:
+                self.sessions = {}
+                self.pid = os.getpid()
+
+            self.__sweep(now)
+
+            try:
+                entry = self.sessions[key]
+            except KeyError:
+                entry = [ self.__new_session(key[0], bind), now, 0 ]
+                self.sessions[key] = entry
+
+            entry[1] = now
+            entry[2] += 1
+            return entry[0]
+
+    def __checkin(self, key, session):
+        """
+        INTERNAL USE ONLY: Stop counting a session as being in use,
+        closing it if it's been dropped from the cache meanwhile.
+        """
+        with self.lock:
+            entry = self.sessions.get(key, None)
+            if entry is not None and entry[0] is session:
+                entry[1] = time.time()
+                entry[2] -= 1
+                return
+        session.close()
+
+    @contextlib.contextmanager
+    def session(self, url, bind):
+        """
+        Get a session suitable for a URL and bind address for the
+        duration of a with block.
+        """
+        key = self.__key(url, bind)
+        session = self.__checkout(key, bind)
+        try:
+            yield session
+        finally:
+            self.__checkin(key, session)
+
+    def clear(self):
+        """
+        Close all sessions.  Those in use are closed when they're done.
+        """
+        with self.lock:
+            for session, last_used, users in self.sessions.values():
+                if users == 0:
+                    session.close()
+            self.sessions = {}
 
 
-def _mount_url(session, url, bind):
+_sessions = _SessionCache()
+
+
+def _session_for(url, bind):
     """
-    Bind the protocol for a URL to an address
+    Get a session from the cache for a URL and bind address, for use
+    in a with block.
     """
-    if bind is None:
-        return
+    return _sessions.session(url, bind)
+
+
+def url_session_configure(
+        pool_size=None,     # Connections kept alive per destination
+        idle_timeout=None   # Seconds before unused sessions are closed
+        ):
+    """
+    Change how HTTP sessions are cached.  This affects only sessions
+    created afterward, so it should be done early.
+    """
+    global _session_pool_size, _session_idle_timeout
+    if pool_size is not None:
+        if pool_size < 1:
+            raise ValueError("Pool size must be positive")
+        _session_pool_size = pool_size
+    if idle_timeout is not None:
+        if idle_timeout < 0:
+            raise ValueError("Idle timeout must not be negative")
+        _session_idle_timeout = idle_timeout
+
 
-    session.mount("%s://" % (urlparse.urlparse(url).scheme),
-                  _SourceAddressAdapter((bind, 0)))
+
+def url_session_cache_clear():
+    """
+    Close all cached HTTP sessions and the connections held by them.
+    """
+    _sessions.clear()
 
 
 
@@ -107,23 +265,21 @@ def url_get( url,          # GET URL
     Fetch a URL using GET with parameters, returning whatever came back.
     """
 
-    with requests.Session() as session:
-        _mount_url(session, url, bind)
-
-        try:
+    try:
+        with _session_for(url, bind) as session:
             request = session.get(url, params=params, verify=verify_keys,
                                   headers=headers, timeout=timeout)
             status = request.status_code
             text = request.text
-        except requests.exceptions.Timeout:
-            status = 400
-            text = "Request timed out"
-        except requests.exceptions.ConnectionError as ex:
-            status = 400
-            text = __formatted_connection_error(ex)
-        except Exception as ex:
-            status = 400
-            text = "Error: %s" % (str(ex))
+    except requests.exceptions.Timeout:
+        status = 400
+        text = "Request timed out"
+    except requests.exceptions.ConnectionError as ex:
+        status = 400
+        text = __formatted_connection_error(ex)
+    except Exception as ex:
+        status = 400
+        text = "Error: %s" % (str(ex))
 
     if status != 200:
         if throw:
@@ -151,24 +307,22 @@ def url_post( url,          # GET URL
     Post to a URL, returning whatever came back.
     """
 
-    with requests.Session() as session:
-        _mount_url(session, url, bind)
-
-        try:
+    try:
+        with _session_for(url, bind) as session:
             request = session.post(url, params=params, data=data,
                                    verify=verify_keys, headers=headers,
                                    timeout=timeout)
             status = request.status_code
             text = request.text
-        except requests.exceptions.Timeout:
-            status = 400
-            text = "Request timed out"
-        except requests.exceptions.ConnectionError as ex:
-            status = 400
-            text = __formatted_connection_error(ex)
-        except Exception as ex:
-            status = 500
-            text = str(ex)
+    except requests.exceptions.Timeout:
+        status = 400
+        text = "Request timed out"
+    except requests.exceptions.ConnectionError as ex:
+        status = 400
+        text = __formatted_connection_error(ex)
+    except Exception as ex:
+        status = 500
+        text = str(ex)
 
 
     if status != 200 and status != 201:
@@ -198,24 +352,22 @@ def url_put( url,          # GET URL
     PUT to a URL, returning whatever came back.
     """
 
-    with requests.Session() as session:
-        _mount_url(session, url, bind)
-
-        try:
+    try:
+        with _session_for(url, bind) as session:
             request = session.put(url, params=params, data=data,
                                   verify=verify_keys, headers=headers,
                                   timeout=timeout)
             status = request.status_code
             text = request.text
-        except requests.exceptions.Timeout:
-            status = 400
-            text = "Request timed out"
-        except requests.exceptions.ConnectionError as ex:
-            status = 400
-            text = __formatted_connection_error(ex)
-        except Exception as ex:
-            status = 500
-            text = str(ex)
+    except requests.exceptions.Timeout:
+        status = 400
+        text = "Request timed out"
+    except requests.exceptions.ConnectionError as ex:
+        status = 400
+        text = __formatted_connection_error(ex)
+    except Exception as ex:
+        status = 500
+        text = str(ex)
 
     if status != 200 and status != 201:
         if throw:
@@ -242,23 +394,21 @@ def url_delete( url,          # DELETE URL
     Delete a URL.
     """
 
-    with requests.Session() as session:
-        _mount_url(session, url, bind)
-
-        try:
+    try:
+        with _session_for(url, bind) as session:
             request = session.delete(url, verify=verify_keys,
                                      headers=headers, timeout=timeout)
             status = request.status_code
             text = request.text
-        except requests.exceptions.Timeout:
-            status = 400
-            text = "Request timed out"
-        except requests.exceptions.ConnectionError as ex:
-            status = 400
-            text = __formatted_connection_error(ex)
-        except Exception as ex:
-            status = 500
-            text = str(ex)
+    except requests.exceptions.Timeout:
+        status = 400
+        text = "Request timed out"
+    except requests.exceptions.ConnectionError as ex:
+        status = 400
+        text = __formatted_connection_error(ex)
+    except Exception as ex:
+        status = 500
+        text = str(ex)
 
 
     if status != 200 and throw: